@@ -0,0 +1,116 @@
+"""
+    Decides whether a signal is worth trading before any IB or database work
+    is done for it.  Everything is checked against the bot's own memory:
+    the traded symbols, recently seen alerts and which positions are open or
+    about to be, so turning a signal away costs microseconds.
+"""
+import datetime
+import time
+
+import constants
+import positions
+
+
+def alert_fingerprint(message_data):
+    """
+        What makes two alerts the same alert, a webhook TradingView retried
+        sends the same fields again.
+    """
+    order = message_data['order']
+
+    return (message_data['symbol'], order['condition'], order['right'], order['action'], order['price'],
+            order['result'])
+
+
+def coalesce_signals(messages, position_open):
+    """
+        Nets out a burst of signals for one key.  Only the last signal
+        decides where the key ends up, so it's the one traded, unless the
+        key is already there and the burst cancels out.  Returns the signal
+        to trade, or None.
+    """
+    last_message = messages[-1]
+    ends_open = last_message['order']['action'] == constants.BUY
+
+    if ends_open == position_open:
+        return None
+
+    return last_message
+
+
+def in_market_hours(market_open, market_close, now=None):
+    """
+        Whether it's a weekday between market_open and market_close, as
+        datetime.time in New York time.  Market holidays aren't known.
+    """
+    now = now or datetime.datetime.now(constants.MARKET_TIMEZONE)
+
+    return now.weekday() < 5 and market_open <= now.time() < market_close
+
+
+class SignalAdmission:
+    def __init__(self, traded_conditions, position_book, dedup_window, market_open, market_close,
+                 check_market_hours=True):
+        self.traded_conditions = traded_conditions
+        self.position_book = position_book
+        self.dedup_window = dedup_window
+        self.market_open = market_open
+        self.market_close = market_close
+        self.check_market_hours = check_market_hours
+        # Fingerprint of each key's last admitted alert and when it came in
+        self.last_admitted = {}
+        # Whether each key will have a position once its queued signals are
+        # done, for keys with signals still queued
+        self.expected_open = {}
+
+    def will_be_open(self, key):
+        if key in self.expected_open:
+            return self.expected_open[key]
+
+        return key in self.position_book
+
+    def admit(self, message_data, now=None):
+        """
+            Returns None if the signal should be traded, or why it shouldn't.
+            An admitted signal counts as done for the checks of the signals
+            after it, settle the key once it's actually been handled.
+        """
+        if now is None:
+            now = time.time()
+        symbol = message_data['symbol']
+        order = message_data['order']
+        condition = order['condition']
+        action = order['action']
+        key = positions.position_key(symbol, condition, order['right'])
+
+        if condition not in self.traded_conditions.get(symbol, ()):
+            return "no condition {} traded for {}".format(condition, symbol)
+
+        if self.check_market_hours and not in_market_hours(self.market_open, self.market_close):
+            return "outside market hours"
+
+        # Only a repeat of the key's last admitted alert is a retry, the same
+        # alert after an opposite one is a new trade
+        fingerprint = alert_fingerprint(message_data)
+        last_fingerprint, admitted_at = self.last_admitted.get(key, (None, None))
+        if fingerprint == last_fingerprint and now - admitted_at < self.dedup_window:
+            return "duplicate of an alert {:.1f}s ago".format(now - admitted_at)
+
+        if action == constants.BUY and self.will_be_open(key):
+            return "{} already has an open position".format(key)
+
+        if action == constants.SELL and not self.will_be_open(key):
+            return "{} has no open position to sell".format(key)
+
+        self.last_admitted[key] = fingerprint, now
+        self.expected_open[key] = action == constants.BUY
+
+        return None
+
+    def settle(self, key):
+        """
+            Called once a key has no signals left queued, from then on the
+            position book says whether it's open.  A BUY that found no
+            contract to buy leaves the key closed again.
+        """
+        self.expected_open.pop(key, None)
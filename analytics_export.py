@@ -0,0 +1,248 @@
+"""
+    Columnar copy of the trade table for analysis, as Parquet or Arrow files
+    partitioned by the month trades were bought in:
+
+        trade_history/buy_month=2024-05/trades.parquet
+
+    Each run only reads the trades changed since the last one, by their
+    updated_timestamp, and rewrites just the months those trades are in.
+    Arrow files can be memory-mapped, so reading years of trades doesn't
+    load them all into memory or go through MySQL at all.
+
+        python analytics_export.py [--format arrow]
+
+    Needs pyarrow, which the bot itself doesn't.
+"""
+import argparse
+import datetime
+import json
+import os
+import time
+
+import mysql.connector
+
+import config
+import tables
+
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.dataset
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+WATERMARK_FILE = "_watermark.json"
+PARTITION_KEY = "buy_month"
+FILE_EXTENSIONS = {'parquet': "parquet", 'arrow': "arrow"}
+
+# Columns of EXPORT_CHANGED_TRADES, in order
+TRADE_COLUMNS = [
+    ('id', 'int64'),
+    ('symbol', 'string'),
+    ('trade_condition', 'string'),
+    ('trade_action', 'string'),
+    ('trade_right', 'string'),
+    ('contracts', 'int32'),
+    ('entryprice', 'decimal'),
+    ('strikeprice', 'string'),
+    ('stoploss', 'decimal'),
+    ('take_profit', 'decimal'),
+    ('buy_delta', 'decimal'),
+    ('buy_gamma', 'decimal'),
+    ('buy_theta', 'decimal'),
+    ('buy_ask', 'decimal'),
+    ('buy_bid', 'decimal'),
+    ('buy_implied_vol', 'decimal'),
+    ('sell_delta', 'decimal'),
+    ('sell_gamma', 'decimal'),
+    ('sell_theta', 'decimal'),
+    ('sell_ask', 'decimal'),
+    ('sell_bid', 'decimal'),
+    ('sell_implied_vol', 'decimal'),
+    ('result', 'string'),
+    ('buy_timestamp', 'timestamp'),
+    ('sell_timestamp', 'timestamp'),
+    ('updated_timestamp', 'timestamp')
+]
+
+
+def trade_schema():
+    """
+        Arrow types matching the trade table, DECIMAL(10, 3) columns stay
+        decimals instead of turning into floats.
+    """
+    types = {
+        'int64': pyarrow.int64(),
+        'int32': pyarrow.int32(),
+        'string': pyarrow.string(),
+        'decimal': pyarrow.decimal128(10, 3),
+        'timestamp': pyarrow.timestamp('s')
+    }
+
+    return pyarrow.schema([(name, types[column_type]) for name, column_type in TRADE_COLUMNS])
+
+
+def read_watermark(path, file_format):
+    """
+        updated_timestamp of the newest trade already exported, or None if
+        everything has to be exported, including when the files there are in
+        another format.
+    """
+    try:
+        with open(os.path.join(path, WATERMARK_FILE), 'r') as watermark_file:
+            watermark = json.load(watermark_file)
+    except FileNotFoundError:
+        return None
+
+    if watermark.get('format') != file_format:
+        return None
+
+    return datetime.datetime.fromisoformat(watermark['updated_timestamp'])
+
+
+def write_watermark(path, watermark, file_format):
+    temporary_path = os.path.join(path, WATERMARK_FILE + ".tmp")
+
+    with open(temporary_path, 'w') as watermark_file:
+        json.dump({
+            'updated_timestamp': watermark.isoformat(),
+            'format': file_format,
+            'exported_at': time.time()
+        }, watermark_file)
+
+    os.replace(temporary_path, os.path.join(path, WATERMARK_FILE))
+
+
+def read_changed_trades(cnx, watermark, schema):
+    """
+        Trades updated at or after the watermark as one Arrow table, read a
+        chunk at a time.  Trades updated in the same second as the watermark
+        are read again, partitions replace them by id.
+    """
+    cursor = cnx.cursor()
+    cursor.execute(tables.EXPORT_CHANGED_TRADES, (watermark or datetime.datetime(1970, 1, 2),))
+    batches = []
+
+    while True:
+        rows = cursor.fetchmany(config.EXPORT_CHUNK_SIZE)
+        if not rows:
+            break
+
+        columns = list(zip(*rows))
+        batches.append(pyarrow.record_batch([
+            pyarrow.array(column, type=field.type) for column, field in zip(columns, schema)
+        ], schema=schema))
+
+    cursor.close()
+
+    return pyarrow.Table.from_batches(batches, schema=schema)
+
+
+def partition_path(path, month, file_format):
+    return os.path.join(path, "{}={}".format(PARTITION_KEY, month), "trades." + FILE_EXTENSIONS[file_format])
+
+
+def read_partition(file_path, file_format):
+    if not os.path.exists(file_path):
+        return None
+
+    if file_format == 'arrow':
+        # The table's buffers point into the map, so it stays open as long as they do
+        return pyarrow.ipc.open_file(pyarrow.memory_map(file_path, 'r')).read_all()
+
+    return pyarrow.parquet.read_table(file_path)
+
+
+def write_partition(file_path, table, file_format):
+    """
+        Replaces the partition file in one step, a crash while writing leaves
+        the previous one in place.
+    """
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    temporary_path = file_path + ".tmp"
+
+    if file_format == 'arrow':
+        # Uncompressed so readers can memory-map it
+        with pyarrow.OSFile(temporary_path, 'wb') as sink:
+            with pyarrow.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+    else:
+        pyarrow.parquet.write_table(table, temporary_path, compression='zstd')
+
+    os.replace(temporary_path, file_path)
+
+
+def merge_partition(existing, changed):
+    """
+        The partition with its changed trades replaced, in id order.
+    """
+    if existing is not None:
+        unchanged = pyarrow.compute.invert(pyarrow.compute.is_in(existing['id'], value_set=changed['id']))
+        changed = pyarrow.concat_tables([existing.filter(unchanged), changed.cast(existing.schema)])
+
+    return changed.sort_by('id')
+
+
+def export_trades(cnx, path, file_format):
+    """
+        Brings the export at path up to date with the trade table.  Returns
+        the number of trades written.
+    """
+    schema = trade_schema()
+    watermark = read_watermark(path, file_format)
+    changed = read_changed_trades(cnx, watermark, schema)
+
+    if changed.num_rows == 0:
+        return 0
+
+    months = pyarrow.compute.strftime(changed['buy_timestamp'], format="%Y-%m")
+
+    for month in pyarrow.compute.unique(months).to_pylist():
+        file_path = partition_path(path, month, file_format)
+        month_trades = changed.filter(pyarrow.compute.equal(months, month))
+        write_partition(file_path, merge_partition(read_partition(file_path, file_format), month_trades),
+                        file_format)
+
+    # Only moved on once every partition is written, a failed run is redone from the old watermark
+    write_watermark(path, pyarrow.compute.max(changed['updated_timestamp']).as_py(), file_format)
+
+    return changed.num_rows
+
+
+def load_trade_history(path=config.ANALYTICS_EXPORT_PATH, file_format=config.ANALYTICS_EXPORT_FORMAT):
+    """
+        The exported trades as a dataset, to filter and read columns from
+        without loading the rest, or call .to_table().to_pandas() on.
+    """
+    return pyarrow.dataset.dataset(path, format='ipc' if file_format == 'arrow' else 'parquet',
+                                   partitioning='hive')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--path', default=config.ANALYTICS_EXPORT_PATH, help="directory the export is kept in")
+    parser.add_argument('--format', choices=list(FILE_EXTENSIONS), default=config.ANALYTICS_EXPORT_FORMAT)
+    args = parser.parse_args()
+
+    if pyarrow is None:
+        print("The analytics export needs pyarrow: pip install pyarrow")
+        exit(1)
+
+    os.makedirs(args.path, exist_ok=True)
+    started = time.perf_counter()
+    cnx = mysql.connector.connect(**config.database_config)
+
+    try:
+        exported = export_trades(cnx, args.path, args.format)
+    finally:
+        cnx.close()
+
+    print("{} | Exported {} changed trade(s) to {} in {:.1f}s".format(
+        time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), exported, args.path,
+        time.perf_counter() - started))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+    Benchmarks the trade queries before and after the schema migrations.
+
+    Loads synthetic trades into a separate benchmark database, then prints
+    the query plan, rows returned and median latency of each query without
+    the migrations' indexes and again with them.  The old date filters that
+    wrapped buy_timestamp in a function are run alongside the range filters
+    in tables.py that replaced them.
+
+        python benchmark_queries.py --rows 2000000
+"""
+import argparse
+import datetime
+import random
+import statistics
+import time
+
+import mysql.connector
+
+import config
+import migrations
+import tables
+
+# Date filters as they were before they were rewritten as ranges
+LEGACY_QUERIES = {
+    'today': """SELECT * FROM trade WHERE DATE(buy_timestamp) = CURDATE()""",
+    'yesterday': """
+        SELECT * FROM trade WHERE buy_timestamp > DATE_SUB(CURRENT_DATE, INTERVAL 1 DAY) and DATE(buy_timestamp) < CURDATE()
+    """,
+    'current month': """SELECT * FROM trade WHERE MONTH(buy_timestamp)=MONTH(now())"""
+}
+
+QUERIES = {
+    'today': tables.RETRIEVE_TRADE_DATA_TODAY,
+    'yesterday': tables.RETRIEVE_TRADE_DATA_YESTERDAY,
+    'current month': tables.RETRIEVE_TRADE_CURRENT_MONTH,
+    'end of day results': tables.END_OF_DAY_RESULTS,
+    'open trade ask price': tables.RETRIEVE_TRADE_ASK_PRICE
+}
+
+INSERT_SYNTHETIC_TRADE = """
+    INSERT INTO trade
+        (
+            symbol,
+            trade_condition,
+            trade_action,
+            trade_right,
+            contracts,
+            entryprice,
+            strikeprice,
+            stoploss,
+            take_profit,
+            buy_delta,
+            buy_gamma,
+            buy_theta,
+            buy_ask,
+            buy_bid,
+            buy_implied_vol,
+            result,
+            buy_timestamp,
+            sell_timestamp
+        )
+    VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+
+def synthetic_trades(count, days):
+    """
+        Trades spread evenly over the last number of days, nearly all of
+        them closed.
+    """
+    now = datetime.datetime.now()
+    symbols = list(config.TRADED_SYMBOLS)
+
+    for _ in range(count):
+        symbol = random.choice(symbols)
+        price = round(random.uniform(50, 500), 2)
+        bought = now - datetime.timedelta(seconds=random.uniform(0, days * 24 * 60 * 60))
+
+        yield (
+            symbol,
+            random.choice(config.TRADED_SYMBOLS[symbol]),
+            'BUY',
+            random.choice(['CALL', 'PUT']),
+            random.randint(1, 3),
+            price,
+            str(round(price)),
+            round(price * 0.98, 2),
+            round(price * 1.02, 2),
+            round(random.uniform(0.3, 0.47), 3),
+            round(random.uniform(0, 0.1), 3),
+            round(random.uniform(-0.5, 0), 3),
+            round(random.uniform(0.5, 10), 2),
+            round(random.uniform(0.5, 10), 2),
+            round(random.uniform(0.2, 1.5), 3),
+            'P' if random.random() < 0.001 else random.choice(['W', 'L']),
+            bought,
+            bought + datetime.timedelta(minutes=random.uniform(1, 300))
+        )
+
+
+def load_trades(cnx, count, days, batch_size=10000):
+    cursor = cnx.cursor()
+    loaded = 0
+    started = time.perf_counter()
+    batch = []
+
+    for trade in synthetic_trades(count, days):
+        batch.append(trade)
+
+        if len(batch) == batch_size:
+            cursor.executemany(INSERT_SYNTHETIC_TRADE, batch)
+            cnx.commit()
+            loaded += len(batch)
+            batch = []
+            print("Loaded {}/{} trades".format(loaded, count), end="\r")
+
+    if batch:
+        cursor.executemany(INSERT_SYNTHETIC_TRADE, batch)
+        cnx.commit()
+
+    cursor.close()
+    print("Loaded {} trades in {:.1f}s".format(count, time.perf_counter() - started))
+
+
+def query_params(name):
+    if name == 'open trade ask price':
+        symbol = next(iter(config.TRADED_SYMBOLS))
+        return symbol, config.TRADED_SYMBOLS[symbol][0], 'CALL'
+
+    return ()
+
+
+def benchmark(cnx, name, query, repeat):
+    """
+        Query plan, rows returned and median seconds of the query.
+    """
+    cursor = cnx.cursor(dictionary=True)
+    params = query_params(name)
+
+    cursor.execute("EXPLAIN " + query, params)
+    plan = cursor.fetchall()
+
+    timings = []
+    rows = 0
+
+    for _ in range(repeat):
+        started = time.perf_counter()
+        cursor.execute(query, params)
+        rows = len(cursor.fetchall())
+        timings.append(time.perf_counter() - started)
+
+    cursor.close()
+
+    return plan, rows, statistics.median(timings)
+
+
+def report(cnx, title, queries, repeat):
+    print("\n=== {} ===".format(title))
+
+    for name, query in queries.items():
+        plan, rows, seconds = benchmark(cnx, name, query, repeat)
+        print("{:<22} {:>10.2f} ms {:>9} row(s)".format(name, seconds * 1000, rows))
+
+        for step in plan:
+            print("    {:<8} type={:<6} key={:<32} rows={:<10} {}".format(
+                step['table'] or '', step['type'] or '', step['key'] or '-', step['rows'] or '',
+                step['Extra'] or ''))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=2000000, help="synthetic trades to load")
+    parser.add_argument('--days', type=int, default=3 * 365, help="days the trades are spread over")
+    parser.add_argument('--repeat', type=int, default=5, help="times each query is run")
+    parser.add_argument('--database', default="trade_benchmark",
+                        help="database to load the trades into, dropped and recreated")
+    args = parser.parse_args()
+
+    database_config = {key: value for key, value in config.database_config.items() if key != 'database'}
+    cnx = mysql.connector.connect(**database_config)
+    cursor = cnx.cursor()
+    cursor.execute("DROP DATABASE IF EXISTS `{}`".format(args.database))
+    cursor.execute("CREATE DATABASE `{}`".format(args.database))
+    cursor.execute("USE `{}`".format(args.database))
+    cursor.execute(tables.CREATE_TRADE_TABLE)
+    cursor.execute(tables.CREATE_OPTIONS_TABLE)
+    cursor.close()
+
+    try:
+        load_trades(cnx, args.rows, args.days)
+
+        report(cnx, "Function-wrapped date filters, no indexes", LEGACY_QUERIES, args.repeat)
+        report(cnx, "Range date filters, no indexes", QUERIES, args.repeat)
+
+        migrations.migrate(cnx)
+        cursor = cnx.cursor()
+        cursor.execute("ANALYZE TABLE trade")
+        cursor.fetchall()
+        cursor.close()
+
+        report(cnx, "Function-wrapped date filters, with indexes", LEGACY_QUERIES, args.repeat)
+        report(cnx, "Range date filters, with indexes", QUERIES, args.repeat)
+    finally:
+        cnx.close()
+
+
+if __name__ == "__main__":
+    main()
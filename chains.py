@@ -0,0 +1,119 @@
+"""
+    Indexes over the option chains returned by reqSecDefOptParams, so a
+    signal can find the strikes around its entry price and the expiration
+    to trade without scanning the whole chain.
+"""
+import bisect
+import datetime
+
+import constants
+
+
+def get_correct_options_expiration(expirations):
+    today_date = datetime.date.today().strftime("%Y%m%d")
+
+    if expirations[0] == today_date:
+        print("This is a zero day expiration date, so use the next expiration date.")
+        expiration = expirations[1]
+    else:
+        expiration = expirations[0]
+
+    print("The correct expiration chosen from list {} based on today's date: {} is {}."
+          .format(expirations, today_date, expiration))
+
+    return expiration
+
+
+class OptionChainIndex:
+    """
+        Sorted strikes and expirations of one option chain, built when the
+        chains are refreshed.  The expiration to trade is resolved once per
+        day rather than once per signal, from the expirations that haven't
+        passed, which a chain restored from a snapshot or kept over a
+        weekend may still list.
+    """
+    def __init__(self, options_chain):
+        self.options_chain = options_chain
+        self.strikes = sorted(options_chain.strikes)
+        expirations = sorted(options_chain.expirations)
+        self.expirations = expirations[bisect.bisect_left(expirations, datetime.date.today().strftime("%Y%m%d")):]
+        self.expiration_date = None
+        self.target_expiration = None
+
+    @property
+    def expiration(self):
+        today = datetime.date.today()
+
+        if self.expiration_date != today:
+            current = self.expirations[bisect.bisect_left(self.expirations, today.strftime("%Y%m%d")):]
+            self.target_expiration = get_correct_options_expiration(current[:2])
+            self.expiration_date = today
+
+        return self.target_expiration
+
+    def trade_expirations(self, count):
+        """
+            The expiration to trade and the count - 1 expirations after it.
+        """
+        expiration = self.expiration
+        start = bisect.bisect_left(self.expirations, expiration)
+
+        return self.expirations[start:start + count]
+
+    def strikes_around(self, price, number_of_strikes):
+        """
+            The number_of_strikes strikes below and above price.  A strike
+            equal to price is in neither.
+        """
+        below = bisect.bisect_left(self.strikes, price)
+        above = bisect.bisect_right(self.strikes, price)
+
+        return self.strikes[max(below - number_of_strikes, 0):below], self.strikes[above:above + number_of_strikes]
+
+    def nearest_strikes(self, price):
+        """
+            The closest strikes below and above price, infinite when there is
+            none on that side.
+        """
+        below = bisect.bisect_left(self.strikes, price)
+        above = bisect.bisect_right(self.strikes, price)
+
+        return (self.strikes[below - 1] if below > 0 else float('-inf'),
+                self.strikes[above] if above < len(self.strikes) else float('inf'))
+
+
+class OptionChainRegistry:
+    """
+        Every chain IB returned for our underlyings, keyed by
+        (symbol, exchange, tradingClass).  A registry is built once per
+        reqSecDefOptParams refresh and never changed afterwards, a refresh
+        builds a new one and swaps it in.
+    """
+    def __init__(self, option_chains):
+        """
+            option_chains: {symbol: [OptionChain, ...]} as returned by
+                reqSecDefOptParams for each underlying.
+        """
+        self.chains_by_symbol = option_chains
+        self.chains = {
+            (symbol, options_chain.exchange, options_chain.tradingClass): options_chain
+            for symbol, symbol_chains in option_chains.items()
+            for options_chain in symbol_chains
+        }
+
+        # The chain we trade for a symbol is the SMART one of its own trading class
+        self.indexes = {}
+        for symbol in option_chains:
+            options_chain = self.get(symbol)
+            if options_chain is not None:
+                self.indexes[symbol] = OptionChainIndex(options_chain)
+
+    def get(self, symbol, exchange=constants.SMART, trading_class=None):
+        """
+            The chain of a symbol on an exchange and trading class, by
+            default the SMART chain of the symbol's own trading class.
+        """
+        return self.chains.get((symbol, exchange, trading_class or symbol))
+
+    def index(self, symbol):
+        return self.indexes.get(symbol)
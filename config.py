@@ -1,6 +1,7 @@
 """
     This is the configuration for servers and variables that are unique to each bot.
 """
+import constants
 
 database_config = {
     'user': 'root',
@@ -9,11 +10,122 @@ database_config = {
     'database': 'trade'
 }
 
+# Pooled connections, shared by the write-behind writer and the reads
+DATABASE_POOL_SIZE = 4
+# Most trades committed together in one transaction
+DATABASE_BATCH_SIZE = 50
+# Seconds between retries while MySQL can't be reached
+DATABASE_RETRY_DELAY = 2
+
+# Trades returned by each page of /api/trades, and the most a page can ask for
+TRADES_PAGE_SIZE = 50
+TRADES_PAGE_MAX_SIZE = 200
+
+# Rows fetched from the server-side cursor at a time while streaming a CSV export
+EXPORT_CHUNK_SIZE = 1000
+
+# Where analytics_export.py keeps the columnar copy of the trade table, as
+# 'parquet' or memory-mappable 'arrow' files
+ANALYTICS_EXPORT_PATH = "trade_history"
+ANALYTICS_EXPORT_FORMAT = "parquet"
+
+# Trade events are journaled here before they reach MySQL
+JOURNAL_PATH = "options_bot.journal"
+# Journal is emptied once everything in it is committed and it's grown past this
+JOURNAL_MAX_BYTES = 1024 * 1024
+# Trade events MySQL refused are moved here to be looked at, rather than replayed forever
+JOURNAL_DEAD_LETTER_PATH = "options_bot.journal.failed"
+
 redis_port = 6379
 localhost_port = 5002
+
+# Async webhook server, ingest.py, publishing alerts to redis in batches of up to INGEST_BATCH_SIZE
+INGEST_PORT = 5003
+INGEST_BATCH_SIZE = 500
+INGEST_MAX_ALERT_BYTES = 16 * 1024
 interactive_brokers_port = 7497
 
 BALANCE = 2500
 RISK = .02
 NUMBER_OF_CONTRACTS = 1
-DELTA_CONSTANT_ADD_CONTRACT = 0.20
\ No newline at end of file
+DELTA_CONSTANT_ADD_CONTRACT = 0.20
+
+# How signals get from the webhook to the bot, "stream" or "pubsub"
+SIGNAL_INGEST_MODE = "stream"
+SIGNAL_CONSUMER_NAME = "options-bot-1"
+SIGNAL_STREAM_MAXLEN = 100000
+SIGNAL_BATCH_SIZE = 50
+SIGNAL_STREAM_BLOCK_MS = 1000
+SIGNAL_RECLAIM_IDLE_MS = 60000
+SIGNAL_RECLAIM_INTERVAL = 30
+# Signals older than this many seconds are acknowledged but not traded on replay
+SIGNAL_MAX_AGE = 900
+
+# Alerts identical to the last one admitted for their key this many seconds ago
+# are dropped as webhook retries
+SIGNAL_DEDUP_WINDOW = 60
+# Signals are only traded on weekdays between these New York times
+CHECK_MARKET_HOURS = True
+MARKET_OPEN = "09:30"
+MARKET_CLOSE = "16:00"
+
+# Seconds a signal waits for more signals of its (symbol, condition, right)
+# before trading, so a quick BUY/SELL flip nets out instead of trading both
+# legs.  0 trades each signal straight away, conditions can have their own.
+SIGNAL_COALESCE_WINDOW = 0
+SIGNAL_COALESCE_WINDOWS = {
+    # constants.SMA_YELLOW: 0.5
+}
+
+# Seconds to wait on any single Interactive Brokers request
+IB_REQUEST_TIMEOUT = 10
+
+# Seconds between checks that the streaming option ladders are still centred
+STREAMING_RECENTER_INTERVAL = 5
+# Streaming ladder of each underlying, strikes on each side of its price in
+# the first STREAMING_EXPIRATIONS we trade
+STREAMING_STRIKE_PRICES = 4
+STREAMING_EXPIRATIONS = 1
+# IB's market data lines, 100 by default, split between streaming, underlyings
+# included, and the snapshots a BUY or SELL takes of contracts not streaming
+MARKET_DATA_LINES = 100
+STREAMING_MAX_LINES = 60
+TICKER_SNAPSHOT_MAX_LINES = MARKET_DATA_LINES - STREAMING_MAX_LINES
+
+# Underlyings the bot trades and the TradingView conditions traded on each
+TRADED_SYMBOLS = {
+    constants.AMAZON: [constants.BREAKOUT, constants.SMA],
+    constants.NVIDIA: [constants.BREAKOUT, constants.SMA, constants.SMA_GREEN, constants.SMA_YELLOW],
+    constants.APPLE: [constants.BREAKOUT, constants.SMA]
+}
+
+# Warm start snapshot of underlyings, chains and qualified contracts
+SNAPSHOT_PATH = "options_bot.snapshot"
+SNAPSHOT_MAX_AGE = 24 * 60 * 60
+# Seconds to wait for more changes before writing the snapshot
+SNAPSHOT_DELAY = 0.5
+
+# Candidate ladder a BUY chooses its contract from, strikes on each side of
+# the entry price in each of the first SELECTION_EXPIRATIONS we trade
+SELECTION_STRIKE_PRICES = 4
+SELECTION_EXPIRATIONS = 2
+# Weights of the contract score, see selection.score_ladder
+CONTRACT_SCORE_WEIGHTS = {
+    'delta': 1.0,
+    'spread': 0.5,
+    'theta': 0.1,
+    'iv': 0.0
+}
+
+# Local greeks are used when IB's were computed from an underlying price
+# that has moved by more than this fraction since
+GREEKS_MAX_UNDERLYING_MOVE = 0.002
+RISK_FREE_RATE = 0.05
+
+# Implied volatility smiles, quotes lose half their weight every
+# SMILE_HALF_LIFE seconds and a smile is used once it has SMILE_MIN_WEIGHT
+SMILE_HALF_LIFE = 300
+SMILE_MIN_WEIGHT = 3
+# Strikes whose smile delta is further than this outside the delta
+# boundaries aren't quoted when choosing a contract
+SMILE_SCREEN_MARGIN = 0.05
@@ -3,6 +3,10 @@
     to reference them easier and create fewer lines of code in other
     files.  Can add any other static variables here.
 """
+from zoneinfo import ZoneInfo
+
+# Market hours and expirations are in New York time
+MARKET_TIMEZONE = ZoneInfo("America/New_York")
 
 BUY = "BUY"
 SELL = "SELL"
@@ -30,4 +34,11 @@ CALL_LOWER_DELTA_BOUNDARY = 0.30
 SET_DELTA_COMPARISON = 0.45
 NUMBER_OF_STRIKE_PRICES = 4
 
-NO_VALID_CONTRACTS = "There were no valid contracts to choose from, not buying anything."
\ No newline at end of file
+NO_VALID_CONTRACTS = "There were no valid contracts to choose from, not buying anything."
+
+TRADINGVIEW_CHANNEL = "tradingview"
+
+PUBSUB = "pubsub"
+STREAM = "stream"
+SIGNAL_STREAM = "tradingview-signals"
+SIGNAL_CONSUMER_GROUP = "options-bot"
@@ -0,0 +1,118 @@
+"""
+    Black-Scholes greeks and implied volatility for a whole ladder of
+    options in one call.  Used in place of IB's model greeks when IB hasn't
+    computed them yet, or computed them from an old underlying price.
+"""
+import datetime
+
+import numpy
+
+import constants
+
+SECONDS_PER_YEAR = 365 * 24 * 60 * 60
+
+MIN_VOLATILITY = 0.001
+MAX_VOLATILITY = 5.0
+VOLATILITY_ITERATIONS = 60
+
+
+def norm_pdf(x):
+    return numpy.exp(-0.5 * x * x) / numpy.sqrt(2 * numpy.pi)
+
+
+def norm_cdf(x):
+    """
+        Standard normal CDF from the Abramowitz and Stegun 7.1.26 erf
+        approximation, accurate to about 1e-7 and NumPy only.
+    """
+    z = numpy.abs(x) / numpy.sqrt(2)
+    t = 1 / (1 + 0.3275911 * z)
+    polynomial = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+    erf = 1 - polynomial * numpy.exp(-z * z)
+
+    return 0.5 * (1 + numpy.sign(x) * erf)
+
+
+def years_to_expiry(expirations, now=None):
+    """
+        Years from now until 16:00 New York time on each expiration,
+        expirations as YYYYMMDD strings.
+    """
+    now = now or datetime.datetime.now(constants.MARKET_TIMEZONE)
+    expiry_seconds = {}
+
+    for expiration in set(expirations):
+        expires_at = datetime.datetime.strptime(expiration, "%Y%m%d").replace(hour=16, tzinfo=constants.MARKET_TIMEZONE)
+        expiry_seconds[expiration] = (expires_at - now).total_seconds()
+
+    return numpy.maximum(numpy.array([expiry_seconds[expiration] for expiration in expirations]), 0) / SECONDS_PER_YEAR
+
+
+def black_scholes(spot, strike, years, volatility, is_call, rate):
+    """
+        Price, delta, gamma, daily theta and vega (per 1.00 of volatility) of
+        European options.  All arguments broadcast against each other.
+    """
+    years = numpy.maximum(years, 1e-8)
+    sqrt_years = numpy.sqrt(years)
+    discount = numpy.exp(-rate * years)
+
+    d1 = (numpy.log(spot / strike) + (rate + 0.5 * volatility ** 2) * years) / (volatility * sqrt_years)
+    d2 = d1 - volatility * sqrt_years
+
+    call_price = spot * norm_cdf(d1) - strike * discount * norm_cdf(d2)
+    put_price = strike * discount * norm_cdf(-d2) - spot * norm_cdf(-d1)
+
+    decay = -spot * norm_pdf(d1) * volatility / (2 * sqrt_years)
+    call_theta = decay - rate * strike * discount * norm_cdf(d2)
+    put_theta = decay + rate * strike * discount * norm_cdf(-d2)
+
+    return {
+        'price': numpy.where(is_call, call_price, put_price),
+        'delta': numpy.where(is_call, norm_cdf(d1), norm_cdf(d1) - 1),
+        'gamma': norm_pdf(d1) / (spot * volatility * sqrt_years),
+        'theta': numpy.where(is_call, call_theta, put_theta) / 365,
+        'vega': spot * norm_pdf(d1) * sqrt_years
+    }
+
+
+def implied_volatility(option_price, spot, strike, years, is_call, rate):
+    """
+        Implied volatility of every option by bisection, which always
+        converges even for deep in or out of the money strikes.  NaN where
+        the price is outside what any volatility between MIN_VOLATILITY and
+        MAX_VOLATILITY gives.
+    """
+    option_price, spot, strike, years, is_call = numpy.broadcast_arrays(
+        option_price, spot, strike, years, is_call)
+    low = numpy.full(option_price.shape, MIN_VOLATILITY)
+    high = numpy.full(option_price.shape, MAX_VOLATILITY)
+
+    low_price = black_scholes(spot, strike, years, low, is_call, rate)['price']
+    high_price = black_scholes(spot, strike, years, high, is_call, rate)['price']
+    solvable = (option_price >= low_price) & (option_price <= high_price)
+
+    # Option prices rise with volatility, so halve the bracket towards the price
+    for _ in range(VOLATILITY_ITERATIONS):
+        middle = (low + high) / 2
+        too_low = black_scholes(spot, strike, years, middle, is_call, rate)['price'] < option_price
+        low = numpy.where(too_low, middle, low)
+        high = numpy.where(too_low, high, middle)
+
+    return numpy.where(solvable, (low + high) / 2, numpy.nan)
+
+
+def ladder_greeks(option_price, spot, strike, years, is_call, rate):
+    """
+        Implied volatility, delta, gamma and theta for a ladder of options
+        from their prices, the way IB reports them.
+    """
+    volatility = implied_volatility(option_price, spot, strike, years, is_call, rate)
+    model = black_scholes(spot, strike, years, volatility, is_call, rate)
+
+    return {
+        'iv': volatility,
+        'delta': model['delta'],
+        'gamma': model['gamma'],
+        'theta': model['theta']
+    }
@@ -1,35 +1,31 @@
 import datetime
+import math
 import time
 import pandas as pd
 import numpy
 import asyncio
-import nest_asyncio
+import functools
 import redis
+import redis.asyncio
 
+import admission
 import config
 import constants
+import greeks
+import selection
+import signals
+import snapshot
 import tables
-import json
+import journal
 import mysql.connector
+import persistence
+import positions
+from chains import OptionChainRegistry
+from smile import VolatilitySmile
 from ib_insync import IB, Stock, Option, LimitOrder
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 
-def get_correct_options_expiration(expirations):
-    today_date = datetime.date.today().strftime("%Y%m%d")
-
-    if expirations[0] == today_date:
-        print("This is a zero day expiration date, so use the next expiration date.")
-        expiration = expirations[1]
-    else:
-        expiration = expirations[0]
-
-    print("The correct expiration chosen from list {} based on today's date: {} is {}."
-          .format(expirations, today_date, expiration))
-
-    return expiration
-
-
 def create_options_contract(symbol, expiration, strike, right):
     """
     Create an Option Contract with following parameters:
@@ -51,6 +47,47 @@ def create_options_contract(symbol, expiration, strike, right):
     )
 
 
+def contract_cache_key(contract):
+    """
+        Key a qualified option contract is cached under, right is normalised
+        to 'C'/'P' so 'CALL'/'PUT' contracts from the database share entries.
+    """
+    return (
+        contract.symbol,
+        contract.lastTradeDateOrContractMonth,
+        float(contract.strike),
+        contract.right[0]
+    )
+
+
+def create_strike_ladder(symbol, chain_index, price, rights, number_of_strikes=constants.NUMBER_OF_STRIKE_PRICES,
+                         expirations=None):
+    """
+        Option contracts for the strikes either side of the price, in the
+        expiration we trade unless other expirations are given.
+    """
+    strikes_below_price, strikes_above_price = chain_index.strikes_around(price, number_of_strikes)
+
+    return [
+        Option(symbol, expiration, strike, right, constants.SMART, tradingClass=symbol)
+        for expiration in expirations or [chain_index.expiration]
+        for right in rights
+        for strike in strikes_below_price + strikes_above_price]
+
+
+def get_underlying_price(ticker):
+    """
+        Latest price of an underlying, falling back to the previous close
+        before the open.  NaN if IB hasn't sent either.
+    """
+    price = ticker.marketPrice()
+
+    if math.isnan(price):
+        price = ticker.close
+
+    return price
+
+
 def set_pandas_configuration():
     pd.options.display.width = None
     pd.options.display.max_columns = None
@@ -58,6 +95,30 @@ def set_pandas_configuration():
     pd.set_option('display.max_columns', 3000)
 
 
+def is_stale_signal(entry_id):
+    """
+        Stream entry ids start with the millisecond timestamp they were added
+        at, which tells us how old a replayed signal is.
+    """
+    if isinstance(entry_id, bytes):
+        entry_id = entry_id.decode()
+
+    added_at = int(entry_id.split('-')[0]) / 1000
+
+    return time.time() - added_at > config.SIGNAL_MAX_AGE
+
+
+def print_startup_phase(phase, phase_started):
+    """
+        Prints how long a startup phase took and returns the time the next
+        phase starts at.
+    """
+    now = time.perf_counter()
+    print("{} took {:.0f} ms".format(phase, (now - phase_started) * 1000))
+
+    return now
+
+
 async def display_trade_information(action, condition, price, result, right, symbol):
     print("\n*********** START Trade ***********\n")
     print("Time: {}".format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))))
@@ -69,14 +130,6 @@ async def display_trade_information(action, condition, price, result, right, sym
     print("Result W/L/P: {}\n".format(result))
 
 
-async def run_periodically(interval, periodic_function):
-    """
-        This runs a function on a specific interval.
-    """
-    while True:
-        await asyncio.gather(asyncio.sleep(interval), periodic_function())
-
-
 class OptionsBot:
     def __init__(self):
         current_time = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))
@@ -85,29 +138,26 @@ class OptionsBot:
         print("*      ", current_time, "       *")
         print("************************************")
 
-        self.breakout_amazon_call_options_contract = None
-        self.breakout_amazon_put_options_contract = None
-        self.sma_amazon_call_options_contract = None
-        self.sma_amazon_put_options_contract = None
-
-        self.breakout_nvidia_call_options_contract = None
-        self.breakout_nvidia_put_options_contract = None
-        self.sma_nvidia_call_options_contract = None
-        self.sma_nvidia_put_options_contract = None
-        self.sma_yellow_nvidia_call_options_contract = None
-        self.sma_yellow_nvidia_put_options_contract = None
-        self.sma_green_nvidia_call_options_contract = None
-        self.sma_green_nvidia_put_options_contract = None
-
-        self.breakout_apple_call_options_contract = None
-        self.breakout_apple_put_options_contract = None
-        self.sma_apple_call_options_contract = None
-        self.sma_apple_put_options_contract = None
+        # Conditions traded on each underlying, as sets for constant time lookups
+        self.traded_conditions = {
+            symbol: set(conditions) for symbol, conditions in config.TRADED_SYMBOLS.items()
+        }
+
+        # Open position of each (symbol, condition, right)
+        self.positions = positions.PositionBook()
+
+        # Turns away signals that can't or shouldn't be traded before any IB work
+        self.admission = admission.SignalAdmission(
+            self.traded_conditions,
+            self.positions,
+            config.SIGNAL_DEDUP_WINDOW,
+            datetime.time.fromisoformat(config.MARKET_OPEN),
+            datetime.time.fromisoformat(config.MARKET_CLOSE),
+            config.CHECK_MARKET_HOURS
+        )
 
         set_pandas_configuration()
 
-        nest_asyncio.apply()
-
         # Redis connection
         self.r = redis.Redis(host='localhost', port=config.redis_port, db=0)
         print("Connecting Redis Server...")
@@ -118,533 +168,942 @@ class OptionsBot:
         except redis.exceptions.ConnectionError as redis_conn_error:
             print(str(redis_conn_error))
 
-        self.p = self.r.pubsub()
-        self.p.subscribe('tradingview')
-
-        self.cnx = mysql.connector.connect(**config.database_config)
-        self.cursor = self.cnx.cursor(buffered=True)
+        # Signals are consumed through an asyncio client so the bot wakes up
+        # as soon as an alert is published instead of polling for it.
+        self.async_r = redis.asyncio.Redis(host='localhost', port=config.redis_port, db=0)
+        self.last_signal_reclaim = 0
+        self.inflight_signal_ids = set()
+
+        # One queue and worker per (symbol, condition, right)
+        self.signal_queues = {}
+        self.signal_workers = {}
+
+        self.journal = journal.TradeJournal(config.JOURNAL_PATH, config.JOURNAL_MAX_BYTES,
+                                            config.JOURNAL_DEAD_LETTER_PATH)
+        self.database = persistence.TradeDatabase(
+            config.database_config,
+            config.DATABASE_POOL_SIZE,
+            config.DATABASE_BATCH_SIZE,
+            config.DATABASE_RETRY_DELAY,
+            self.journal
+        )
 
         try:
-            self.cursor.execute(tables.CREATE_TRADE_TABLE)
-            self.cursor.execute(tables.CREATE_OPTIONS_TABLE)
-            self.cursor.execute(tables.CREATE_ACCOUNT_SUMMARY_TABLE)
-            self.cnx.commit()
+            self.database.execute_now([
+                (tables.CREATE_TRADE_TABLE, ()),
+                (tables.CREATE_OPTIONS_TABLE, ()),
+                (tables.CREATE_ACCOUNT_SUMMARY_TABLE, ()),
+                (tables.CREATE_JOURNAL_EVENTS_TABLE, ())
+            ])
+            self.database.migrate()
         except mysql.connector.Error as err:
-            print("Failed creating table: {}".format(err))
+            print("Failed creating or migrating tables: {}".format(err))
             exit(1)
 
+        self.ib = IB()
+        self.connection_lock = asyncio.Lock()
+
+        # Qualified option contracts keyed by (symbol, expiry, strike, right),
+        # None marks a contract IB couldn't qualify
+        self.qualified_options_contracts = {}
+
+        # Implied volatility smile of each (symbol, expiration) we get quotes for
+        self.volatility_smiles = {}
+
+        # Pending write of the warm start snapshot
+        self.snapshot_task = None
+
+        # Startup work left running in the background, referenced so it isn't
+        # garbage collected before it's done
+        self.validate_task = None
+        self.prewarm_task = None
+        self.reconcile_task = None
+
+        # Streaming tickers for each underlying and for the option ladder
+        # around its price, keyed like the contract cache
+        self.underlying_tickers = {}
+        self.streaming_tickers = {}
+        self.streaming_ladder_bounds = {}
+
+        # Market data lines taken by snapshots in flight
+        self.snapshot_lines = asyncio.Condition()
+        self.snapshot_lines_used = 0
+
+        asyncio.run(self.run())
+
+    async def run(self):
+        """
+            Connects to Interactive Brokers and loads the option chains, then
+            listens for signals.  Everything runs on this one event loop, IB
+            requests are awaited instead of blocking it.
+        """
+        self.journal.start()
+        self.database.start()
+        self.replay_journal()
+
         print("Retrieving initial option chains...")
+        startup_started = phase_started = time.perf_counter()
 
         try:
-            self.ib = IB()
-            self.ib.connect('127.0.0.1', config.interactive_brokers_port, clientId=1)
+            await self.ib.connectAsync('127.0.0.1', config.interactive_brokers_port, clientId=1,
+                                       timeout=config.IB_REQUEST_TIMEOUT)
         except Exception as e:
             print(str(e))
 
-        self.amazon_stock_contract = Stock(constants.AMAZON, constants.SMART, constants.USD)
-        self.nvidia_stock_contract = Stock(constants.NVIDIA, constants.SMART, constants.USD)
-        self.apple_stock_contract = Stock(constants.APPLE, constants.SMART, constants.USD)
-        self.ib.qualifyContracts(self.amazon_stock_contract)
-        self.ib.qualifyContracts(self.nvidia_stock_contract)
-        self.ib.qualifyContracts(self.apple_stock_contract)
-
-        # request a list of option chains
-        self.amazon_option_chains = self.ib.reqSecDefOptParams(self.amazon_stock_contract.symbol, '',
-                                                               self.amazon_stock_contract.secType,
-                                                               self.amazon_stock_contract.conId)
-        self.nvidia_option_chains = self.ib.reqSecDefOptParams(self.nvidia_stock_contract.symbol, '',
-                                                               self.nvidia_stock_contract.secType,
-                                                               self.nvidia_stock_contract.conId)
-        self.apple_option_chains = self.ib.reqSecDefOptParams(self.apple_stock_contract.symbol, '',
-                                                              self.apple_stock_contract.secType,
-                                                              self.apple_stock_contract.conId)
+        self.watch_fills()
+
+        phase_started = print_startup_phase("Connecting to Interactive Brokers", phase_started)
+
+        if self.restore_snapshot(snapshot.load_snapshot(config.SNAPSHOT_PATH, config.SNAPSHOT_MAX_AGE)):
+            phase_started = print_startup_phase("Restoring snapshot", phase_started)
+            self.validate_task = asyncio.create_task(self.validate_snapshot())
+        else:
+            # All underlyings are qualified in one request, IB answers them concurrently
+            self.stock_contracts = {
+                symbol: Stock(symbol, constants.SMART, constants.USD) for symbol in config.TRADED_SYMBOLS
+            }
+            await self.qualify_contracts(*self.stock_contracts.values())
+
+            phase_started = print_startup_phase("Qualifying {} underlying(s)".format(len(self.stock_contracts)),
+                                                phase_started)
+
+            # request a list of option chains
+            self.option_chains = await self.load_option_chains()
+            self.save_snapshot()
+
+            phase_started = print_startup_phase("Downloading option chains", phase_started)
+
+        await self.load_positions()
+        # IB can take seconds to report positions, so they're checked once trading has started
+        self.reconcile_task = asyncio.create_task(self.reconcile_positions())
+        print_startup_phase("Loading {} open position(s)".format(len(self.positions)), phase_started)
+
+        print_startup_phase("Startup", startup_started)
 
         print("Running Live!")
 
+        self.prewarm_task = asyncio.create_task(self.prewarm_options_contracts())
+
+        self.subscribe_underlyings()
+
         self.schedule = AsyncIOScheduler(daemon=True)
         self.schedule.add_job(self.update_options_chains, 'cron', day_of_week='mon-fri', hour='8')
         self.schedule.add_job(self.check_connection, 'cron', day_of_week='mon-fri', hour='9')
         self.schedule.add_job(self.sell_remaining_contracts_end_of_day, 'cron', day_of_week='mon-fri', hour='15', minute='55')
+        self.schedule.add_job(self.sync_streaming_ladders, 'interval', seconds=config.STREAMING_RECENTER_INTERVAL)
         self.schedule.start()
 
-        asyncio.run(run_periodically(1, self.check_messages))
-        self.ib.run()
+        await self.check_messages()
 
-    async def check_messages(self):
+    def restore_snapshot(self, state):
+        """
+            Restores the state saved by save_snapshot.  Returns False when
+            there's no snapshot or it was written for a different list of
+            underlyings, and startup has to ask IB for everything instead.
+        """
+        if state is None:
+            return False
+
+        if set(state['stock_contracts']) != set(config.TRADED_SYMBOLS):
+            print("Snapshot was written for different underlyings, not restoring it.")
+            return False
+
+        self.stock_contracts = state['stock_contracts']
+        self.option_chains = OptionChainRegistry(state['option_chains'])
+        self.qualified_options_contracts.update(state['qualified_options_contracts'])
+        self.evict_expired_options_contracts()
+
+        print("Restored snapshot with {} qualified contract(s)".format(len(self.qualified_options_contracts)))
+
+        return True
+
+    async def validate_snapshot(self):
+        """
+            Checks the restored state against IB in the background, signals
+            are traded with the restored state in the meantime.
+        """
+        try:
+            stock_contracts = {
+                symbol: Stock(symbol, constants.SMART, constants.USD) for symbol in config.TRADED_SYMBOLS
+            }
+            await self.qualify_contracts(*stock_contracts.values())
+
+            for symbol, stock_contract in stock_contracts.items():
+                if stock_contract.conId and stock_contract.conId != self.stock_contracts[symbol].conId:
+                    print("Snapshot had the wrong contract for {}, replacing it.".format(symbol))
+                    self.stock_contracts[symbol] = stock_contract
+
+            self.option_chains = await self.load_option_chains()
+            self.save_snapshot()
+
+            print("{} | Validated snapshot against Interactive Brokers".format(
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))))
+        except Exception as e:
+            print("Failed validating snapshot: {}".format(e))
+
+    def save_snapshot(self):
+        """
+            Saves the IB state for a warm start.  Saves asked for while one is
+            pending are written together.
+        """
+        if self.snapshot_task is None or self.snapshot_task.done():
+            self.snapshot_task = asyncio.create_task(self.write_snapshot())
+
+    async def write_snapshot(self):
+        await asyncio.sleep(config.SNAPSHOT_DELAY)
+
+        data = snapshot.dump_snapshot({
+            'stock_contracts': self.stock_contracts,
+            'option_chains': self.option_chains.chains_by_symbol,
+            'qualified_options_contracts': {
+                key: contract for key, contract in self.qualified_options_contracts.items() if contract is not None
+            }
+        })
+
+        try:
+            await asyncio.to_thread(snapshot.write_snapshot, config.SNAPSHOT_PATH, data)
+        except OSError as err:
+            print("Failed writing snapshot: {}".format(err))
+
+    async def qualify_contracts(self, *contracts):
+        return await asyncio.wait_for(self.ib.qualifyContractsAsync(*contracts), config.IB_REQUEST_TIMEOUT)
+
+    async def qualify_options_contracts(self, *contracts):
+        """
+            Qualifies option contracts through the cache.  Only contracts not
+            seen before go to IB, together in one request.  Returns a list in
+            the same order as contracts, with None for any that couldn't be
+            qualified.
+        """
+        keys = [contract_cache_key(contract) for contract in contracts]
+        missing = {}
+
+        for contract, key in zip(contracts, keys):
+            if key not in self.qualified_options_contracts:
+                missing[key] = contract
+
+        if missing:
+            # qualifyContracts fills in conId on the contracts it can qualify
+            await self.qualify_contracts(*missing.values())
+
+            for key, contract in missing.items():
+                self.qualified_options_contracts[key] = contract if contract.conId else None
+
+            self.save_snapshot()
+
+        return [self.qualified_options_contracts[key] for key in keys]
+
+    def evict_expired_options_contracts(self):
+        today_date = datetime.date.today().strftime("%Y%m%d")
+        expired_keys = [key for key in self.qualified_options_contracts if key[1] < today_date]
+
+        for key in expired_keys:
+            del self.qualified_options_contracts[key]
+
+        if expired_keys:
+            self.save_snapshot()
+
+        print("{} | Evicted {} expired option contract(s) from the cache".format(
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), len(expired_keys)))
+
+    async def close_expired_positions(self):
+        today_date = datetime.date.today().strftime("%Y%m%d")
+
+        for key, position in list(self.positions.items()):
+            if position.contract.lastTradeDateOrContractMonth < today_date:
+                self.positions.close(key)
+                await self.record_unsold_position(key, "expired")
+
+    async def prewarm_options_contracts(self):
+        """
+            Qualifies the near the money ladder a BUY picks its contract from
+            for every underlying, so a signal doesn't wait on qualification.
+        """
+        stock_contracts = list(self.stock_contracts.values())
+
+        try:
+            tickers = await self.request_tickers(*stock_contracts)
+            ladder_contracts = []
+
+            for stock_contract, ticker in zip(stock_contracts, tickers):
+                price = get_underlying_price(ticker)
+                if math.isnan(price):
+                    print("No price for {}, not prewarming its contracts.".format(stock_contract.symbol))
+                    continue
+
+                chain_index = self.option_chains.index(stock_contract.symbol)
+                if chain_index is None:
+                    continue
+
+                ladder_contracts += create_strike_ladder(stock_contract.symbol, chain_index, price, ['C', 'P'],
+                                                         config.SELECTION_STRIKE_PRICES,
+                                                         chain_index.trade_expirations(config.SELECTION_EXPIRATIONS))
+
+            qualified = await self.qualify_options_contracts(*ladder_contracts)
+
+            print("{} | Prewarmed {} option contract(s)".format(
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())),
+                sum(1 for contract in qualified if contract)))
+        except Exception as e:
+            print("Failed prewarming option contracts: {}".format(e))
+
+    def subscribe_underlyings(self):
+        for stock_contract in self.stock_contracts.values():
+            self.underlying_tickers[stock_contract.symbol] = self.ib.reqMktData(stock_contract, '', False, False)
+
+    async def sync_streaming_ladders(self):
+        """
+            Keeps streaming subscriptions on the near the money ladder of every
+            underlying.  A ladder is only re-centred once the underlying moves
+            past the strikes either side of where it was last centred.  Only
+            as many ladders as fit in STREAMING_MAX_LINES are streamed.
+        """
+        wanted_contracts = {}
+        # Where each re-centred ladder is centred, recorded once it's subscribed
+        centred_bounds = {}
+
+        for symbol, underlying_ticker in self.underlying_tickers.items():
+            price = get_underlying_price(underlying_ticker)
+            if math.isnan(price):
+                continue
+
+            bounds = self.streaming_ladder_bounds.get(symbol)
+            if bounds is not None and bounds[0] < price < bounds[1]:
+                wanted_contracts.update(
+                    (key, ticker.contract) for key, ticker in self.streaming_tickers.items() if key[0] == symbol)
+                continue
+
+            chain_index = self.option_chains.index(symbol)
+            if chain_index is None:
+                continue
+
+            ladder = await self.qualify_options_contracts(
+                *create_strike_ladder(symbol, chain_index, price, ['C', 'P'], config.STREAMING_STRIKE_PRICES,
+                                      chain_index.trade_expirations(config.STREAMING_EXPIRATIONS)))
+
+            print("{} | Centring streaming ladder for {} on {}".format(
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), symbol, price))
+
+            qualified = [contract for contract in ladder if contract is not None]
+            if not qualified:
+                # Keep streaming the old ladder and try centring again next time
+                wanted_contracts.update(
+                    (key, ticker.contract) for key, ticker in self.streaming_tickers.items() if key[0] == symbol)
+                continue
+
+            if len(self.underlying_tickers) + len(wanted_contracts) + len(qualified) > config.STREAMING_MAX_LINES:
+                print("{} | No market data lines left to stream {}'s ladder".format(
+                    time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), symbol))
+                continue
+
+            for contract in qualified:
+                wanted_contracts[contract_cache_key(contract)] = contract
+
+            centred_bounds[symbol] = chain_index.nearest_strikes(price)
+
+        for key in list(self.streaming_tickers):
+            if key not in wanted_contracts:
+                self.ib.cancelMktData(self.streaming_tickers.pop(key).contract)
+
+        for key, contract in wanted_contracts.items():
+            if key not in self.streaming_tickers:
+                self.streaming_tickers[key] = self.ib.reqMktData(contract, '', False, False)
+
+        self.streaming_ladder_bounds.update(centred_bounds)
+
+        # Keep the smiles up to date from the quotes already streaming in
+        quoted_tickers = [ticker for ticker in self.streaming_tickers.values() if ticker.ask > 0]
+        if quoted_tickers:
+            self.get_ladder(quoted_tickers)
+
+    def reset_streaming_subscriptions(self):
+        """
+            Subscriptions belong to the IB connection, so after a reconnect
+            everything is subscribed again from scratch.
+        """
+        self.underlying_tickers = {}
+        self.streaming_tickers = {}
+        self.streaming_ladder_bounds = {}
+        self.subscribe_underlyings()
+
+    def get_streaming_ticker(self, contract):
+        """
+            The streaming ticker for a contract, if it's subscribed and IB has
+            sent a quote for it.  Greeks IB hasn't sent yet are filled in by
+            get_ladder.
+        """
+        ticker = self.streaming_tickers.get(contract_cache_key(contract))
+
+        if ticker is None or not self.ib.isConnected():
+            return None
+
+        if not ticker.ask > 0:
+            return None
+
+        return ticker
+
+    async def get_tickers(self, *contracts):
+        """
+            Latest tickers for contracts, in the same order.  Contracts on a
+            streaming ladder are read from memory, snapshots of the rest are
+            requested together.
+        """
+        tickers = [self.get_streaming_ticker(contract) for contract in contracts]
+        missing = [contract for contract, ticker in zip(contracts, tickers) if ticker is None]
+
+        if missing:
+            snapshots = iter(await self.request_tickers(*missing))
+            tickers = [next(snapshots) if ticker is None else ticker for ticker in tickers]
+
+        return tickers
+
+    def get_ladder(self, tickers):
+        """
+            Quotes and greeks of tickers as arrays.  Greeks IB hasn't computed
+            yet, or computed from an underlying price that has since moved by
+            more than GREEKS_MAX_UNDERLYING_MOVE, are computed locally from
+            the ask instead of waiting on IB.
+        """
+        ladder = selection.ladder_arrays(tickers)
+
+        spot = numpy.array([
+            get_underlying_price(self.underlying_tickers[symbol]) if symbol in self.underlying_tickers else numpy.nan
+            for symbol in ladder['symbol']
+        ])
+        stale = numpy.abs(ladder['und_price'] / spot - 1) > config.GREEKS_MAX_UNDERLYING_MOVE
+        missing = (numpy.isnan(ladder['delta']) | stale) & numpy.isfinite(spot) & numpy.isfinite(ladder['ask'])
+
+        if missing.any():
+            model = greeks.ladder_greeks(
+                ladder['ask'][missing],
+                spot[missing],
+                ladder['strike'][missing],
+                greeks.years_to_expiry([expiration for expiration, is_missing in
+                                        zip(ladder['expiration'], missing) if is_missing]),
+                ladder['is_call'][missing],
+                config.RISK_FREE_RATE
+            )
+
+            for name in ['delta', 'gamma', 'theta', 'iv']:
+                ladder[name][missing] = model[name]
+
+        self.update_volatility_smiles(ladder, spot)
+
+        return ladder
+
+    def update_volatility_smiles(self, ladder, spot):
+        """
+            Feeds the implied volatilities of a ladder into the smile of each
+            symbol and expiration in it.
         """
-            On an interval set to 1 second, and constantly checks for new
-            messages from redis.  Once the message is received, it will
-            then parse it and then check what to do such as Buy or Sell
-            an Options Contract.
-        """
-
-        message = self.p.get_message()
-
-        if message is not None and message['type'] == 'message':
-            await self.check_connection()
-            await self.check_database_connection()
-
-            message_data = json.loads(message['data'])
-
-            symbol = message_data['symbol']
-            condition = message_data['order']['condition']
-            price = message_data['order']['price']
-            right = message_data['order']['right']
-            action = message_data['order']['action']
-            result = message_data['order']['result']
-
-            await display_trade_information(action, condition, price, result, right, symbol)
-
-            if action == constants.BUY:
-                options_chain = self.get_correct_options_chain(symbol)
-
-                strikes_after_entry_price_call = [strike for strike in options_chain.strikes
-                                                  if strike > price]
-                strikes_before_entry_price_call = [strike for strike in options_chain.strikes
-                                                   if strike < price]
-                expirations = sorted(exp for exp in options_chain.expirations)[:2]
-
-                correct_expiration = get_correct_options_expiration(expirations)
-
-                call_above_entry_price = [
-                    Option(symbol, correct_expiration, strike, right, constants.SMART, tradingClass=symbol)
-                    for right in ['C']
-                    for strike in strikes_after_entry_price_call[:constants.NUMBER_OF_STRIKE_PRICES]]
-                call_below_entry_price = [
-                    Option(symbol, correct_expiration, strike, right, constants.SMART, tradingClass=symbol)
-                    for right in ['C']
-                    for strike in strikes_before_entry_price_call[-constants.NUMBER_OF_STRIKE_PRICES:]]
-                put_above_entry_price = [
-                    Option(symbol, correct_expiration, strike, right, constants.SMART, tradingClass=symbol)
-                    for right in ['P']
-                    for strike in strikes_after_entry_price_call[:constants.NUMBER_OF_STRIKE_PRICES]]
-                put_below_entry_price = [
-                    Option(symbol, correct_expiration, strike, right, constants.SMART, tradingClass=symbol)
-                    for right in ['P']
-                    for strike in strikes_before_entry_price_call[-constants.NUMBER_OF_STRIKE_PRICES:]]
-
-                if symbol == constants.AMAZON:
-                    if right == constants.CALL:
-                        call_contracts = numpy.concatenate((call_below_entry_price, call_above_entry_price))
-                        valid_contracts = self.ib.qualifyContracts(*call_contracts)
-
-                        if condition == "breakout":
-                            self.breakout_amazon_call_options_contract = await self.get_correct_contract_with_delta(
-                                valid_contracts)
-
-                            if self.breakout_amazon_call_options_contract is not None:
-                                await self.place_options_order(
-                                    message_data,
-                                    action,
-                                    condition,
-                                    self.breakout_amazon_call_options_contract
-                                )
-                            else:
-                                print(constants.NO_VALID_CONTRACTS)
-                        elif condition == "sma":
-                            self.sma_amazon_call_options_contract = await self.get_correct_contract_with_delta(
-                                valid_contracts)
-
-                            if self.sma_amazon_call_options_contract is not None:
-                                await self.place_options_order(
-                                    message_data,
-                                    action,
-                                    condition,
-                                    self.sma_amazon_call_options_contract
-                                )
-                            else:
-                                print(constants.NO_VALID_CONTRACTS)
-                    else:
-                        put_contracts = numpy.concatenate((put_below_entry_price, put_above_entry_price))
-                        valid_contracts = self.ib.qualifyContracts(*put_contracts)
-
-                        if condition == "breakout":
-                            self.breakout_amazon_put_options_contract = await self.get_correct_contract_with_delta(
-                                valid_contracts)
-
-                            if self.breakout_amazon_put_options_contract is not None:
-                                await self.place_options_order(
-                                    message_data,
-                                    action,
-                                    condition,
-                                    self.breakout_amazon_put_options_contract
-                                )
-                            else:
-                                print(constants.NO_VALID_CONTRACTS)
-                        elif condition == "sma":
-                            self.sma_amazon_put_options_contract = await self.get_correct_contract_with_delta(
-                                valid_contracts)
-
-                            if self.sma_amazon_put_options_contract is not None:
-                                await self.place_options_order(
-                                    message_data,
-                                    action,
-                                    condition,
-                                    self.sma_amazon_put_options_contract
-                                )
-                            else:
-                                print(constants.NO_VALID_CONTRACTS)
-                elif symbol == constants.NVIDIA:
-                    if right == constants.CALL:
-                        call_contracts = numpy.concatenate((call_below_entry_price, call_above_entry_price))
-                        valid_contracts = self.ib.qualifyContracts(*call_contracts)
-
-                        if condition == "breakout":
-                            self.breakout_nvidia_call_options_contract = await self.get_correct_contract_with_delta(
-                                valid_contracts)
-
-                            await self.place_options_order(
-                                message_data,
-                                action,
-                                condition,
-                                self.breakout_nvidia_call_options_contract
-                            )
-                        elif condition == "sma":
-                            self.sma_nvidia_call_options_contract = await self.get_correct_contract_with_delta(
-                                valid_contracts)
-
-                            await self.place_options_order(
-                                message_data,
-                                action,
-                                condition,
-                                self.sma_nvidia_call_options_contract
-                            )
-                        elif condition == constants.SMA_GREEN:
-                            self.sma_green_nvidia_call_options_contract = await self.get_correct_contract_with_delta(
-                                valid_contracts)
-
-                            await self.place_options_order(
-                                message_data,
-                                action,
-                                condition,
-                                self.sma_green_nvidia_call_options_contract
-                            )
-                        elif condition == constants.SMA_YELLOW:
-                            self.sma_yellow_nvidia_call_options_contract = await self.get_correct_contract_with_delta(
-                                valid_contracts)
-
-                            await self.place_options_order(
-                                message_data,
-                                action,
-                                condition,
-                                self.sma_yellow_nvidia_call_options_contract
-                            )
-                        else:
-                            print("No condition with this name: {}".format(condition))
-                    else:
-                        put_contracts = numpy.concatenate((put_below_entry_price, put_above_entry_price))
-                        valid_contracts = self.ib.qualifyContracts(*put_contracts)
-
-                        if condition == "breakout":
-                            self.breakout_nvidia_put_options_contract = await self.get_correct_contract_with_delta(
-                                valid_contracts)
-
-                            await self.place_options_order(
-                                message_data,
-                                action,
-                                condition,
-                                self.breakout_nvidia_put_options_contract
-                            )
-                        elif condition == "sma":
-                            self.sma_nvidia_put_options_contract = await self.get_correct_contract_with_delta(
-                                valid_contracts)
-
-                            await self.place_options_order(
-                                message_data,
-                                action,
-                                condition,
-                                self.sma_nvidia_put_options_contract
-                            )
-                        elif condition == constants.SMA_GREEN:
-                            self.sma_green_nvidia_put_options_contract = await self.get_correct_contract_with_delta(
-                                valid_contracts)
-
-                            await self.place_options_order(
-                                message_data,
-                                action,
-                                condition,
-                                self.sma_green_nvidia_put_options_contract
-                            )
-                        elif condition == constants.SMA_YELLOW:
-                            self.sma_yellow_nvidia_put_options_contract = await self.get_correct_contract_with_delta(
-                                valid_contracts)
-
-                            await self.place_options_order(
-                                message_data,
-                                action,
-                                condition,
-                                self.sma_yellow_nvidia_put_options_contract
-                            )
-                elif symbol == constants.APPLE:
-                    if right == constants.CALL:
-                        call_contracts = numpy.concatenate((call_below_entry_price, call_above_entry_price))
-                        valid_contracts = self.ib.qualifyContracts(*call_contracts)
-
-                        if condition == "breakout":
-                            self.breakout_apple_call_options_contract = await self.get_correct_contract_with_delta(
-                                valid_contracts)
-
-                            await self.place_options_order(
-                                message_data,
-                                action,
-                                condition,
-                                self.breakout_apple_call_options_contract
-                            )
-                        elif condition == "sma":
-                            self.sma_apple_call_options_contract = await self.get_correct_contract_with_delta(
-                                valid_contracts)
-
-                            await self.place_options_order(
-                                message_data,
-                                action,
-                                condition,
-                                self.sma_apple_call_options_contract
-                            )
-                    else:
-                        put_contracts = numpy.concatenate((put_below_entry_price, put_above_entry_price))
-                        valid_contracts = self.ib.qualifyContracts(*put_contracts)
-
-                        if condition == "breakout":
-                            self.breakout_apple_put_options_contract = await self.get_correct_contract_with_delta(
-                                valid_contracts)
-
-                            await self.place_options_order(
-                                message_data,
-                                action,
-                                condition,
-                                self.breakout_apple_put_options_contract
-                            )
-                        elif condition == "sma":
-                            self.sma_apple_put_options_contract = await self.get_correct_contract_with_delta(
-                                valid_contracts)
-
-                            await self.place_options_order(
-                                message_data,
-                                action,
-                                condition,
-                                self.sma_apple_put_options_contract
-                            )
-            elif action == constants.SELL:
-                if symbol == constants.AMAZON:
-                    if condition == "breakout":
-                        if right == "CALL":
-                            await self.sell_contract(action, condition, symbol,
-                                                     self.breakout_amazon_call_options_contract, result)
-                            self.breakout_amazon_call_options_contract = None
-                        if right == "PUT":
-                            await self.sell_contract(action, condition, symbol,
-                                                     self.breakout_amazon_put_options_contract, result)
-                            self.breakout_amazon_put_options_contract = None
-                    if condition == "sma":
-                        if right == "CALL":
-                            await self.sell_contract(action, condition, symbol,
-                                                     self.sma_amazon_call_options_contract, result)
-                            self.sma_amazon_call_options_contract = None
-                        if right == "PUT":
-                            await self.sell_contract(action, condition, symbol,
-                                                     self.sma_amazon_put_options_contract, result)
-                            self.sma_amazon_put_options_contract = None
-                elif symbol == constants.NVIDIA:
-                    if condition == constants.BREAKOUT:
-                        if right == "CALL":
-                            await self.sell_contract(action, condition, symbol,
-                                                     self.breakout_nvidia_call_options_contract, result)
-                            self.breakout_nvidia_call_options_contract = None
-                        if right == "PUT":
-                            await self.sell_contract(action, condition, symbol,
-                                                     self.breakout_nvidia_put_options_contract, result)
-                            self.breakout_nvidia_put_options_contract = None
-                    elif condition == "sma":
-                        if right == "CALL":
-                            await self.sell_contract(action, condition, symbol,
-                                                     self.sma_nvidia_call_options_contract, result)
-                            self.sma_nvidia_call_options_contract = None
-                        if right == "PUT":
-                            await self.sell_contract(action, condition, symbol,
-                                                     self.sma_nvidia_put_options_contract, result)
-                            self.sma_nvidia_put_options_contract = None
-                    elif condition == constants.SMA_GREEN:
-                        if right == "CALL":
-                            await self.sell_contract(action, condition, symbol,
-                                                     self.sma_green_nvidia_call_options_contract, result)
-                            self.sma_nvidia_call_options_contract = None
-                        if right == "PUT":
-                            await self.sell_contract(action, condition, symbol,
-                                                     self.sma_green_nvidia_put_options_contract, result)
-                            self.sma_nvidia_put_options_contract = None
-                    elif condition == constants.SMA_YELLOW:
-                        if right == "CALL":
-                            await self.sell_contract(action, condition, symbol,
-                                                     self.sma_yellow_nvidia_call_options_contract, result)
-                            self.sma_nvidia_call_options_contract = None
-                        if right == "PUT":
-                            await self.sell_contract(action, condition, symbol,
-                                                     self.sma_yellow_nvidia_put_options_contract, result)
-                            self.sma_nvidia_put_options_contract = None
-                elif symbol == constants.APPLE:
-                    if condition == "breakout":
-                        if right == "CALL":
-                            await self.sell_contract(action, condition, symbol,
-                                                     self.breakout_apple_call_options_contract, result)
-                            self.breakout_apple_call_options_contract = None
-                        if right == "PUT":
-                            await self.sell_contract(action, condition, symbol,
-                                                     self.breakout_apple_put_options_contract, result)
-                            self.breakout_apple_put_options_contract = None
-                    if condition == "sma":
-                        if right == "CALL":
-                            await self.sell_contract(action, condition, symbol,
-                                                     self.sma_apple_call_options_contract, result)
-                            self.sma_apple_call_options_contract = None
-                        if right == "PUT":
-                            await self.sell_contract(action, condition, symbol,
-                                                     self.sma_apple_put_options_contract, result)
-                            self.sma_apple_put_options_contract = None
+        rows_by_smile = {}
+
+        for index, key in enumerate(zip(ladder['symbol'], ladder['expiration'])):
+            rows_by_smile.setdefault(key, []).append(index)
+
+        for key, rows in rows_by_smile.items():
+            if key not in self.volatility_smiles:
+                self.volatility_smiles[key] = VolatilitySmile(config.SMILE_HALF_LIFE)
+
+            self.volatility_smiles[key].update(numpy.log(ladder['strike'][rows] / spot[rows]), ladder['iv'][rows])
+
+    def get_smile_deltas(self, contracts):
+        """
+            Deltas of contracts from the fitted smiles, without any market
+            data requests.  NaN where there's no smile or underlying price yet.
+        """
+        deltas = numpy.full(len(contracts), numpy.nan)
+        rows_by_smile = {}
+
+        for index, contract in enumerate(contracts):
+            rows_by_smile.setdefault((contract.symbol, contract.lastTradeDateOrContractMonth), []).append(index)
+
+        for (symbol, expiration), rows in rows_by_smile.items():
+            volatility_smile = self.volatility_smiles.get((symbol, expiration))
+            if volatility_smile is None or volatility_smile.weight < config.SMILE_MIN_WEIGHT:
+                continue
+
+            if symbol not in self.underlying_tickers:
+                continue
+
+            spot = get_underlying_price(self.underlying_tickers[symbol])
+            if math.isnan(spot):
+                continue
+
+            strikes = numpy.array([float(contracts[row].strike) for row in rows])
+            is_call = numpy.array([contracts[row].right.startswith('C') for row in rows])
+            model = greeks.black_scholes(
+                spot,
+                strikes,
+                greeks.years_to_expiry([expiration]),
+                volatility_smile.implied_vol(numpy.log(strikes / spot)),
+                is_call,
+                config.RISK_FREE_RATE
+            )
+            deltas[rows] = model['delta']
+
+        return deltas
+
+    async def request_tickers(self, *contracts):
+        """
+            Snapshots of contracts, in the same order.  Every request
+            together takes at most TICKER_SNAPSHOT_MAX_LINES market data
+            lines at once, so with the streaming lines they stay under IB's
+            limit.
+        """
+        tickers = []
+
+        for start in range(0, len(contracts), config.TICKER_SNAPSHOT_MAX_LINES):
+            chunk = contracts[start:start + config.TICKER_SNAPSHOT_MAX_LINES]
+
+            async with self.snapshot_lines:
+                await self.snapshot_lines.wait_for(
+                    lambda: self.snapshot_lines_used + len(chunk) <= config.TICKER_SNAPSHOT_MAX_LINES)
+                self.snapshot_lines_used += len(chunk)
+
+            try:
+                tickers += await asyncio.wait_for(self.ib.reqTickersAsync(*chunk), config.IB_REQUEST_TIMEOUT)
+            finally:
+                async with self.snapshot_lines:
+                    self.snapshot_lines_used -= len(chunk)
+                    self.snapshot_lines.notify_all()
+
+        return tickers
+
+    async def load_option_chains(self):
+        """
+            Requests the chains of every underlying at the same time.  An
+            underlying whose request fails is left out rather than failing
+            the rest.
+        """
+        symbols = list(self.stock_contracts)
+        responses = await asyncio.gather(
+            *[self.request_option_chains(self.stock_contracts[symbol]) for symbol in symbols],
+            return_exceptions=True)
+
+        option_chains = {}
+
+        for symbol, response in zip(symbols, responses):
+            if isinstance(response, Exception):
+                print("Failed retrieving option chains for {}: {!r}".format(symbol, response))
             else:
-                print("Only action known is BUY and SELL, we don't do anything with this:", action)
-
-    def get_correct_options_chain(self, symbol):
-        options_chain = None
-
-        if symbol == constants.AMAZON:
-            options_chain = next(c for c in self.amazon_option_chains if
-                                 c.exchange == constants.SMART and
-                                 c.tradingClass == constants.AMAZON)
-        elif symbol == constants.NVIDIA:
-            options_chain = next(c for c in self.nvidia_option_chains if
-                                 c.exchange == constants.SMART and
-                                 c.tradingClass == constants.NVIDIA)
-        elif symbol == constants.APPLE:
-            options_chain = next(c for c in self.apple_option_chains if
-                                 c.exchange == constants.SMART and
-                                 c.tradingClass == constants.APPLE)
-
-        return options_chain
-
-    async def check_database_connection(self):
-        """ Connect to MySQL database """
-        if not self.cnx.is_connected() or not self.ib.client.isConnected():
+                option_chains[symbol] = response
+
+        return OptionChainRegistry(option_chains)
+
+    async def request_option_chains(self, stock_contract):
+        return await asyncio.wait_for(
+            self.ib.reqSecDefOptParamsAsync(stock_contract.symbol, '', stock_contract.secType, stock_contract.conId),
+            config.IB_REQUEST_TIMEOUT)
+
+    async def check_messages(self):
+        """
+            Waits for new signals from redis, either from the durable signal
+            stream or from the tradingview pub/sub channel depending on
+            config.SIGNAL_INGEST_MODE.
+        """
+        if config.SIGNAL_INGEST_MODE == constants.STREAM:
+            await self.consume_signal_stream()
+        else:
+            await self.consume_signal_channel()
+
+    async def consume_signal_channel(self):
+        """
+            Subscribes to the tradingview channel and waits on it until a
+            message is published.  Every message already queued is handled
+            straight away, so a burst of alerts is drained without waiting
+            between them.
+        """
+        p = self.async_r.pubsub(ignore_subscribe_messages=True)
+        await p.subscribe(constants.TRADINGVIEW_CHANNEL)
+
+        while True:
             try:
-                print("Attempting Reconnection to MySQL Database...")
-                self.cnx.disconnect()
-                self.cnx = mysql.connector.connect(**config.database_config)
-                print("Reconnected to MySQL Database @",
-                      time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())))
-            except mysql.connector.Error as err:
-                print(err)
+                async for message in p.listen():
+                    if message['type'] == 'message':
+                        try:
+                            await self.handle_message(message['data'])
+                        except Exception as e:
+                            print("{} | Failed handling signal {}: {}".format(
+                                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), message['data'], e))
+            except redis.exceptions.ConnectionError as redis_conn_error:
+                print("{} | Lost connection to Redis, resubscribing: {}".format(
+                    time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), redis_conn_error))
+                await asyncio.sleep(1)
+
+    async def consume_signal_stream(self):
+        """
+            Reads signals from the redis stream as a member of the bot's
+            consumer group.  Entries stay pending until they are acknowledged,
+            so anything published while the bot is down or busy is picked up
+            once it is reading again:
+
+            1. Replay entries this consumer was given but never acknowledged.
+            2. Reclaim entries left pending too long by any other consumer.
+            3. Block on new entries and handle them in batches.
+        """
+        # Catch-up replay, reading from an id returns this consumer's
+        # pending entries after it rather than new ones.  It's only done
+        # once, after that pending entries may already be queued.
+        caught_up = False
+        last_id = '0'
+
+        while True:
+            try:
+                if not caught_up:
+                    await self.create_signal_consumer_group()
+
+                    while True:
+                        entries = await self.read_signal_stream(last_id)
+                        if not entries:
+                            break
+                        last_id = entries[-1][0]
+
+                    caught_up = True
+
+                if time.time() - self.last_signal_reclaim > config.SIGNAL_RECLAIM_INTERVAL:
+                    await self.reclaim_pending_signals()
+
+                await self.read_signal_stream('>', block=config.SIGNAL_STREAM_BLOCK_MS)
+            except redis.exceptions.ConnectionError as redis_conn_error:
+                print("{} | Lost connection to Redis, retrying signal stream: {}".format(
+                    time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), redis_conn_error))
+                await asyncio.sleep(1)
+
+    async def create_signal_consumer_group(self):
+        try:
+            await self.async_r.xgroup_create(constants.SIGNAL_STREAM, constants.SIGNAL_CONSUMER_GROUP,
+                                             id='0', mkstream=True)
+            print("Created consumer group {} on {}".format(constants.SIGNAL_CONSUMER_GROUP, constants.SIGNAL_STREAM))
+        except redis.exceptions.ResponseError as err:
+            # BUSYGROUP means the group already exists, which is the normal case
+            if 'BUSYGROUP' not in str(err):
+                raise
+
+    async def read_signal_stream(self, stream_id, block=None):
+        """
+            Reads a batch of entries for this consumer and queues them.
+            Returns the entries read.
+        """
+        response = await self.async_r.xreadgroup(
+            constants.SIGNAL_CONSUMER_GROUP,
+            config.SIGNAL_CONSUMER_NAME,
+            {constants.SIGNAL_STREAM: stream_id},
+            count=config.SIGNAL_BATCH_SIZE,
+            block=block
+        )
+
+        if not response:
+            return []
+
+        entries = response[0][1]
+        await self.handle_signal_entries(entries)
+
+        return entries
+
+    async def reclaim_pending_signals(self):
+        """
+            Takes over entries another consumer read but never acknowledged,
+            e.g. a bot that crashed in the middle of a trade.
+        """
+        self.last_signal_reclaim = time.time()
+        start_id = '0-0'
+
+        while True:
+            response = await self.async_r.xautoclaim(
+                constants.SIGNAL_STREAM,
+                constants.SIGNAL_CONSUMER_GROUP,
+                config.SIGNAL_CONSUMER_NAME,
+                min_idle_time=config.SIGNAL_RECLAIM_IDLE_MS,
+                start_id=start_id,
+                count=config.SIGNAL_BATCH_SIZE
+            )
+            start_id, entries = response[0], response[1]
+
+            if entries:
+                print("{} | Reclaimed {} pending signal(s)".format(
+                    time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), len(entries)))
+                await self.handle_signal_entries(entries)
+
+            if start_id in (b'0-0', '0-0'):
+                break
+
+    async def handle_signal_entries(self, entries):
+        """
+            Queues each entry on its signal pipeline.  An entry is only
+            acknowledged once its pipeline has finished with it, anything
+            that can't be traded is acknowledged straight away.
+        """
+        entry_ids = []
+
+        for entry_id, fields in entries:
+            # Still queued in one of our pipelines, e.g. reclaimed from ourselves
+            if entry_id in self.inflight_signal_ids:
+                continue
+
+            # Entries deleted by trimming come back without fields
+            if not fields:
+                entry_ids.append(entry_id)
+                continue
+
+            if is_stale_signal(entry_id):
+                print("{} | Skipping stale signal {}: {}".format(
+                    time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), entry_id, fields[b'data']))
+                entry_ids.append(entry_id)
+                continue
+
+            try:
+                self.inflight_signal_ids.add(entry_id)
+                await self.handle_message(fields[b'data'], functools.partial(self.ack_signal, entry_id))
+            except Exception as e:
+                print("{} | Failed handling signal {}: {}".format(
+                    time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), entry_id, e))
+                self.inflight_signal_ids.discard(entry_id)
+                entry_ids.append(entry_id)
+
+        if entry_ids:
+            await self.async_r.xack(constants.SIGNAL_STREAM, constants.SIGNAL_CONSUMER_GROUP, *entry_ids)
+
+    async def ack_signal(self, entry_id):
+        self.inflight_signal_ids.discard(entry_id)
+        await self.async_r.xack(constants.SIGNAL_STREAM, constants.SIGNAL_CONSUMER_GROUP, entry_id)
+
+    async def handle_message(self, data, on_done=None):
+        """
+            Parses a message from redis and queues it on the signal pipeline
+            for its symbol, condition and right.  on_done is awaited once the
+            pipeline has finished with the signal, or straight away if the
+            signal isn't admitted.
+        """
+        message_data = signals.validate_alert(data)
+
+        symbol = message_data['symbol']
+        condition = message_data['order']['condition']
+        price = message_data['order']['price']
+        right = message_data['order']['right']
+        action = message_data['order']['action']
+        result = message_data['order']['result']
+
+        rejection = self.admission.admit(message_data)
+        if rejection is not None:
+            print("{} | Rejected {} {} {} {} signal: {}".format(
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), action, symbol, condition, right,
+                rejection))
+            if on_done is not None:
+                await on_done()
+            return
+
+        # Queued before anything is awaited, so the key can't be settled in between
+        self.dispatch_signal(positions.position_key(symbol, condition, right), message_data, on_done)
+
+        await display_trade_information(action, condition, price, result, right, symbol)
+
+    def dispatch_signal(self, key, message_data, on_done=None):
+        """
+            Each (symbol, condition, right) gets its own queue and worker, so
+            signals for one key are handled in order while signals for
+            different keys are handled at the same time.
+        """
+        if key not in self.signal_queues:
+            self.signal_queues[key] = asyncio.Queue()
+            self.signal_workers[key] = asyncio.create_task(self.signal_worker(key))
+
+        self.signal_queues[key].put_nowait((message_data, on_done))
+
+    async def signal_worker(self, key):
+        queue = self.signal_queues[key]
+        coalesce_window = config.SIGNAL_COALESCE_WINDOWS.get(key[1], config.SIGNAL_COALESCE_WINDOW)
+
+        while True:
+            batch = [await queue.get()]
+
+            if coalesce_window:
+                # Let a burst for this key arrive, then trade what it nets out to
+                await asyncio.sleep(coalesce_window)
+                while not queue.empty():
+                    batch.append(queue.get_nowait())
+
+            message_data = batch[0][0]
+            if len(batch) > 1:
+                message_data = admission.coalesce_signals([message for message, _ in batch], key in self.positions)
+                print("{} | Coalesced {} signals for {} ({}) into {}".format(
+                    time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), len(batch), key,
+                    ", ".join(message['order']['action'] for message, _ in batch),
+                    message_data['order']['action'] if message_data else "nothing"))
+
+            if message_data is not None:
+                try:
+                    await self.check_connection()
+                    await self.execute_signal(message_data)
+                except Exception as e:
+                    print("{} | Failed executing signal for {}: {}".format(
+                        time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), key, e))
+
+            # Every signal of the burst is done, traded or netted out
+            for _, on_done in batch:
+                if on_done is not None:
+                    try:
+                        await on_done()
+                    except Exception as e:
+                        print("{} | Failed acknowledging signal for {}: {}".format(
+                            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), key, e))
+
+                queue.task_done()
+
+            if queue.empty():
+                self.admission.settle(key)
+
+    async def execute_signal(self, message_data):
+        """
+            Checks what to do with a signal such as Buy or Sell an Options
+            Contract.
+        """
+        symbol = message_data['symbol']
+        condition = message_data['order']['condition']
+        price = message_data['order']['price']
+        right = message_data['order']['right']
+        action = message_data['order']['action']
+        result = message_data['order']['result']
+
+        key = positions.position_key(symbol, condition, right)
+
+        if action == constants.BUY:
+            chain_index = self.option_chains.index(symbol)
+            if chain_index is None:
+                print("No option chain for {}, not buying anything.".format(symbol))
+                return
+
+            ladder_contracts = create_strike_ladder(symbol, chain_index, price,
+                                                    ['C' if right == constants.CALL else 'P'],
+                                                    config.SELECTION_STRIKE_PRICES,
+                                                    chain_index.trade_expirations(config.SELECTION_EXPIRATIONS))
+            valid_contracts = [contract for contract in await self.qualify_options_contracts(*ladder_contracts)
+                               if contract]
+
+            options_contract = await self.get_correct_contract_with_delta(valid_contracts)
+
+            if options_contract is not None:
+                await self.place_options_order(
+                    message_data,
+                    action,
+                    key,
+                    options_contract
+                )
+            else:
+                print(constants.NO_VALID_CONTRACTS)
+        elif action == constants.SELL:
+            await self.sell_contract(action, key, self.positions.get(key), result)
         else:
-            print("Still connected to MySQL Database!")
+            print("Only action known is BUY and SELL, we don't do anything with this:", action)
 
-    async def place_options_order(self, message_data, action, condition, contract):
-        ticker_data = self.ib.reqTickers(contract)
+    async def place_options_order(self, message_data, action, key, contract):
+        ticker_data = await self.get_tickers(contract)
 
         # all greeks, then get ask and delta
-        ask_greeks = ticker_data[0].askGreeks
-        bid = ticker_data[0].bid
+        greeks_row = selection.ladder_row(self.get_ladder(ticker_data), 0)
+        bid = greeks_row['bid']
         ask = ticker_data[0].ask
-        theta = ask_greeks.theta
-        delta = ask_greeks.delta
-        gamma = ask_greeks.gamma
-        implied_volatility = ask_greeks.impliedVol
+        theta = greeks_row['theta']
+        delta = greeks_row['delta']
+        gamma = greeks_row['gamma']
+        implied_volatility = greeks_row['iv']
 
         number_of_contracts = config.NUMBER_OF_CONTRACTS
 
-        if abs(delta) < config.DELTA_CONSTANT_ADD_CONTRACT:
+        if delta is not None and abs(delta) < config.DELTA_CONSTANT_ADD_CONTRACT:
             number_of_contracts = number_of_contracts + 1
 
         limit_order = LimitOrder(action, number_of_contracts, ask)
 
-        self.ib.placeOrder(
+        trade = self.ib.placeOrder(
             contract,
             limit_order
         )
+        self.positions.open(key, contract, number_of_contracts, trade.order.orderId, ask)
+        buy_time = datetime.datetime.now()
 
-        self.insert_option_contract(
-            condition,
-            contract,
-            number_of_contracts
-        )
-
-        self.save_data(message_data, number_of_contracts, contract.strike, ask, bid, gamma, delta, theta,
-                       implied_volatility)
+        await self.record_trade([
+            persistence.insert_option_statement(key[1], contract, number_of_contracts),
+            persistence.insert_trade_statement(message_data, number_of_contracts, contract.strike, ask, bid, gamma,
+                                               delta, theta, implied_volatility, buy_time),
+            persistence.insert_trade_stats_statement(message_data, buy_time)
+        ])
 
         print("{} | Successfully placed order!".format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))))
         print("*********** END Trade ***********")
 
-    async def sell_contract(self, action, condition, symbol, contract, result):
-        found_in_database = False
-        contracts_from_buy_trade = 0
-
-        if contract is None:
-            print("{} | Attempt 1: Didn't have contract stored in session to Sell".format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))))
-            retrieved_contract, number_of_contracts = self.check_for_options_contract(symbol, condition)
-
-            if retrieved_contract is not None:
-                print("{} | Attempt 2: Found in database".format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))))
-                print("{} | Contract Found: {}".format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), retrieved_contract))
-                found_in_database = True
-                contracts_from_buy_trade = number_of_contracts
-                contract = retrieved_contract
-
-        if contract:
-            ticker_data = self.ib.reqTickers(contract)
-            ask_greeks = ticker_data[0].askGreeks
-            ask = ticker_data[0].ask
-            bid = ticker_data[0].bid
-            delta = ask_greeks.delta
-            gamma = ask_greeks.gamma
-            theta = ask_greeks.theta
-            implied_vol = ask_greeks.impliedVol
-
-            if not found_in_database:
-                contracts_from_buy_trade = self.get_trade_contracts(symbol, condition)
-
-            sell_limit_order = LimitOrder(action, contracts_from_buy_trade, ask)
-            sell_trade = self.ib.placeOrder(contract, sell_limit_order)
+    async def sell_contract(self, action, key, position, result):
+        """
+            Sells an open position.  Everything the order needs is in the
+            position book, so it's placed without asking the database or IB
+            about the contract first.  The position stays in the book until
+            the order has been placed.
+        """
+        symbol, condition, right = key
 
-            print("{} | Trade: {}".format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), sell_trade))
-            print("{} | Successfully Sold Trade".format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))))
+        if position is None:
+            print("{} | No open position for {} to Sell".format(
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), key))
+            return
 
-            self.delete_options_contract(symbol, condition)
-            self.update_data(result, condition, symbol, ask, bid, delta, gamma, theta, implied_vol)
+        contract = position.contract
 
-            print("\n*********** END Trade ***********\n")
-        else:
-            print("Attempt 2: Couldn't find in database.")
+        ticker_data = await self.get_tickers(contract)
+        greeks_row = selection.ladder_row(self.get_ladder(ticker_data), 0)
+        ask = ticker_data[0].ask
+        bid = greeks_row['bid']
+        delta = greeks_row['delta']
+        gamma = greeks_row['gamma']
+        theta = greeks_row['theta']
+        implied_vol = greeks_row['iv']
+
+        # The end of day sell may have sold it while the quote was awaited
+        if self.positions.get(key) is not position:
+            print("{} | Position {} was already sold".format(
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), key))
+            return
+
+        sell_limit_order = LimitOrder(action, position.quantity, ask)
+        sell_trade = self.ib.placeOrder(contract, sell_limit_order)
+        self.positions.close(key)
+        sell_time = datetime.datetime.now()
+
+        print("{} | Trade: {}".format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), sell_trade))
+        print("{} | Successfully Sold Trade".format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))))
+
+        await self.record_trade([
+            persistence.delete_option_statement(symbol, condition, right),
+            persistence.update_trade_stats_statement(result, condition, symbol, right),
+            persistence.update_trade_statement(result, condition, symbol, ask, bid, delta, gamma, theta,
+                                               implied_vol, right, sell_time)
+        ])
+
+        print("\n*********** END Trade ***********\n")
 
     async def ticker_info(self, contracts):
-        ticker_full_data = self.ib.reqTickers(*contracts)
-        list(ticker_full_data)
-
-        valid_deltas = []
-        invalid_deltas = []
-        all_deltas = [ticker.askGreeks.delta for ticker in ticker_full_data]
-
-        if ticker_full_data[0].askGreeks.delta > 0:
-            for i in range(len(all_deltas)):
-                if all_deltas[i] is not None:
-                    if constants.CALL_UPPER_DELTA_BOUNDARY > all_deltas[i] > constants.CALL_LOWER_DELTA_BOUNDARY:
-                        valid_deltas.append(all_deltas[i])
-                    else:
-                        invalid_deltas.append(all_deltas[i])
-
-            closest_ticker_index = max(range(len(ticker_full_data)),
-                                       key=lambda i: ticker_full_data[
-                                                         i].askGreeks.delta < constants.CALL_UPPER_DELTA_BOUNDARY)
-        else:
-            for i in range(len(all_deltas)):
-                if all_deltas[i] is not None:
-                    if constants.PUT_UPPER_DELTA_BOUNDARY < all_deltas[i] < constants.PUT_LOWER_DELTA_BOUNDARY:
-                        valid_deltas.append(all_deltas[i])
-                    else:
-                        invalid_deltas.append(all_deltas[i])
+        """
+            Scores the whole ladder of contracts at once and returns the best
+            one inside the delta boundaries, or None if there isn't one.
+        """
+        # Strikes the smile puts well outside the delta boundaries aren't worth
+        # a snapshot, ones already streaming are free to keep
+        smile_deltas = self.get_smile_deltas(contracts)
+        worth_quoting = (numpy.isnan(smile_deltas) |
+                         selection.delta_in_bounds(smile_deltas, contracts[0].right, config.SMILE_SCREEN_MARGIN))
+        contracts = [contract for contract, keep in zip(contracts, worth_quoting)
+                     if keep or self.get_streaming_ticker(contract) is not None]
+
+        if not contracts:
+            return None
 
-            closest_ticker_index = min(range(len(ticker_full_data)),
-                                       key=lambda i: ticker_full_data[
-                                                         i].askGreeks.delta > constants.PUT_UPPER_DELTA_BOUNDARY)
+        ticker_full_data = await self.get_tickers(*contracts)
+        ladder = self.get_ladder(ticker_full_data)
 
-            if closest_ticker_index > 0:
-                closest_ticker_index = closest_ticker_index - 1
+        closest_ticker_index = selection.best_contract_index(ladder, contracts[0].right,
+                                                             config.CONTRACT_SCORE_WEIGHTS)
+
+        if closest_ticker_index is None:
+            return None
 
         return ticker_full_data[closest_ticker_index].contract
 
@@ -658,212 +1117,210 @@ class OptionsBot:
                 time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), chosen_options_contract))
             return chosen_options_contract
 
-    def delete_options_contract(self, symbol, condition):
-        sql_query = tables.DELETE_OPTION_DATA
-        sql_input = (symbol, condition)
+    async def record_trade(self, statements):
+        """
+            Journals a trade's statements to disk, then leaves them to the
+            write-behind writer.  The signal is only acknowledged after this
+            returns, so the trade is never lost even if MySQL is down.
+        """
+        event = await self.journal.append(statements)
+        self.database.submit(event)
 
-        try:
-            cursor = self.cnx.cursor(buffered=True)
-            cursor.execute(sql_query, sql_input)
-            self.cnx.commit()
-            cursor.close()
-            print("Successfully DELETED Option from table!")
-        except mysql.connector.Error as err:
-            print("Failed deleting option from table: {}".format(err))
-
-    def save_data(self, message_data, number_of_contracts, strike_price, ask, bid, gamma, delta, theta, implied_vol):
-        sql_query = tables.INSERT_TRADE_DATA
-        sql_input = (
-            message_data['symbol'],
-            message_data['order']['condition'],
-            message_data['order']['action'],
-            message_data['order']['right'],
-            number_of_contracts,
-            message_data['order']['price'],
-            strike_price,
-            message_data['order']['stoploss'],
-            message_data['order']['takeProfit'],
-            delta,
-            gamma,
-            theta,
-            ask,
-            bid,
-            implied_vol,
-            message_data['order']['result']
-        )
+    def replay_journal(self):
+        events = self.journal.replay()
 
-        try:
-            cursor = self.cnx.cursor(buffered=True)
-            cursor.execute(sql_query, sql_input)
-            self.cnx.commit()
-            cursor.close()
-            print("{} | Successfully INSERTED Trade data into Database!".format(
-                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))))
-        except mysql.connector.Error as err:
-            print("Failed saving data to signals table: {}".format(err))
+        if events:
+            print("{} | Replaying {} trade event(s) from the journal".format(
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), len(events)))
 
-    def get_trade_contracts(self, symbol, condition):
-        sqlite_insert_with_param = tables.GET_MATCHING_TRADE
-        sqlite_data = (
-            symbol,
-            condition
-        )
+        for event in events:
+            self.database.submit(event)
+
+    async def load_positions(self):
+        """
+            Rebuilds the position book from the options table.  The contracts
+            come from the snapshot's qualified contracts when there is one.
+        """
+        rows = []
+        buy_asks = {}
 
         try:
-            self.cnx.row_factory = lambda curs, row: row[0]
-            cursor = self.cnx.cursor(buffered=True)
-            cursor.execute(sqlite_insert_with_param, sqlite_data)
-            number_of_contracts = cursor.fetchone()
+            rows = await self.database.fetchall(tables.RETRIEVE_OPTION_ALL_REMAINING_CONTRACTS)
+            # Kept on each position so selling it never has to ask the database
+            for symbol, condition, right, buy_ask in await self.database.fetchall(
+                    tables.RETRIEVE_PENDING_TRADE_ASK_PRICES):
+                buy_asks[positions.position_key(symbol, condition, right)] = buy_ask
         except mysql.connector.Error as err:
-            print("Failed getting number of trade contracts for {} - {}: {}".format(symbol, condition, err))
+            print("{} | Failed RETRIEVING open positions from Database: {}".format(
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), err))
 
-        return number_of_contracts[0]
+        today_date = datetime.date.today().strftime("%Y%m%d")
 
-    def update_data(self, result, condition, symbol, sell_ask, sell_bid, sell_delta, sell_gamma, sell_theta,
-                    sell_implied_vol):
-        sql_update_query = tables.UPDATE_TRADE_DATA
-        sql_input_data = (
-            result, sell_delta, sell_gamma, sell_theta, sell_ask, sell_bid, sell_implied_vol, condition, symbol)
+        for row in [row for row in rows if row[2] < today_date]:
+            await self.record_unsold_position(positions.position_key(row[0], row[1], row[4]), "expired")
 
-        try:
-            cursor = self.cnx.cursor(buffered=True)
-            cursor.execute(sql_update_query, sql_input_data)
-            self.cnx.commit()
-            rows_affected = cursor.rowcount
-            print("Successfully UPDATED {} row(s) data into Database!".format(rows_affected))
-            cursor.close()
-        except mysql.connector.Error as err:
-            print("Failed updating data to database: {}".format(err))
-
-    def insert_option_contract(self, condition, contract, number_of_contracts):
-        sqlite_insert_with_param = tables.INSERT_OPTION_DATA
-        sqlite_data = (
-            condition,
-            contract.symbol,
-            contract.lastTradeDateOrContractMonth,
-            contract.strike,
-            contract.right,
-            contract.exchange,
-            contract.tradingClass,
-            number_of_contracts
-        )
+        rows = [row for row in rows if row[2] >= today_date]
 
-        try:
-            cursor = self.cnx.cursor(buffered=True)
-            cursor.execute(sqlite_insert_with_param, sqlite_data)
-            self.cnx.commit()
-            cursor.close()
-            print("{} | Successfully INSERTED Options data into Database!".format(
-                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))))
-        except mysql.connector.Error as err:
-            print("{} | Failed INSERTING options data into database: {}".format(
-                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), err))
+        if rows:
+            contracts = await self.qualify_options_contracts(
+                *[create_options_contract(row[0], row[2], row[3], row[4]) for row in rows])
+
+            for row, contract in zip(rows, contracts):
+                if contract is None:
+                    print("Couldn't qualify open position: {}".format(row))
+                    continue
 
-    def sell_remaining_contracts_end_of_day(self):
-        sql_query = tables.RETRIEVE_OPTION_ALL_REMAINING_CONTRACTS
+                key = positions.position_key(row[0], row[1], row[4])
+                self.positions.open(key, contract, row[5], buy_ask=buy_asks.get(key))
 
+    async def reconcile_positions(self):
         try:
-            cursor = self.cnx.cursor(buffered=True)
-            cursor.execute(sql_query)
-            rows = cursor.fetchall()
-        except mysql.connector.Error as err:
-            print("{} | Failed RETRIEVING reminaining Option Contract(s) from Database: {}".format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), err))
+            broker_positions = await asyncio.wait_for(self.ib.reqPositionsAsync(), config.IB_REQUEST_TIMEOUT)
+        except Exception as e:
+            print("Failed requesting positions from Interactive Brokers: {}".format(e))
+            return
 
-        print(rows)
+        held = {}
+        for broker_position in broker_positions:
+            held[broker_position.contract.conId] = held.get(broker_position.contract.conId, 0) + broker_position.position
 
-        if rows:
-            for row in rows:
-                options_symbol = row[0]
-                options_condition = row[1]
-                options_expiration = row[2]
-                options_strike = row[3]
-                options_right = row[4]
-                number_of_contracts = row[5]
-                contract = create_options_contract(options_symbol, options_expiration, options_strike, options_right)
-                self.ib.qualifyContracts(contract)
-
-                print("Contract:", contract)
-                print("Condition:", options_condition)
-
-                ticker_data = self.ib.reqTickers(contract)
-                ask_greeks = ticker_data[0].askGreeks
-                ask = ticker_data[0].ask
-                bid = ticker_data[0].bid
-                delta = ask_greeks.delta
-                gamma = ask_greeks.gamma
-                theta = ask_greeks.theta
-                implied_vol = ask_greeks.impliedVol
-
-                sell_limit_order = LimitOrder(constants.SELL, number_of_contracts, ask)
-                sell_trade = self.ib.placeOrder(contract, sell_limit_order)
-
-                print("{} | Trade: {}".format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), sell_trade))
-                print("{} | Successfully Sold Trade".format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))))
+        working_buys = {
+            trade.order.orderId: trade.contract.conId
+            for trade in self.ib.openTrades() if trade.order.action == constants.BUY
+        }
 
-                try:
-                    sql_query_ask = tables.RETRIEVE_TRADE_ASK_PRICE
-                    cursor = self.cnx.cursor(buffered=True)
-                    cursor.execute(sql_query_ask)
-                    row = cursor.fetchone()
-
-                    trade_right = row[0]
-                    trade_ask_price = row[1]
-                except mysql.connector.Error as err:
-                    print("Failed RETRIEVING reminaining Option Contract(s) from Database: {}".format(err))
-
-                if trade_right == constants.CALL:
-                    if trade_ask_price > ask:
-                        result = "L"
-                    else:
-                        result = "W"
-                else:
-                    if trade_ask_price > ask:
-                        result = "W"
-                    else:
-                        result = "L"
-
-                self.delete_options_contract(options_symbol, options_condition)
-                self.update_data(result, options_condition, options_symbol, ask, bid, delta, gamma, theta, implied_vol)
-        else:
-            print("{} | No Contracts to Sell at the end of the day".format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))))
+        for key in self.positions.reconcile(held, working_buys):
+            print("{} | Position {} didn't match Interactive Brokers: {}".format(
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), key,
+                self.positions.positions.get(key, "not held")))
 
-    def check_for_options_contract(self, symbol, condition):
-        sql_query = tables.RETRIEVE_OPTION_CONTRACT
-        sql_input = (symbol, condition)
+            if key not in self.positions:
+                await self.record_unsold_position(key, "not held by Interactive Brokers")
 
-        try:
-            cursor = self.cnx.cursor(buffered=True)
-            cursor.execute(sql_query, sql_input)
-            row = cursor.fetchone()
-        except mysql.connector.Error as err:
-            print("{} | Failed RETRIEVING Options Contract from Database: {}".format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), err))
+    async def record_unsold_position(self, key, reason):
+        """
+            Closes the trade of a position that ended without the bot selling
+            it, so its options row and pending trade don't come back on the
+            next start.  Nothing was sold, so nothing was won.
+        """
+        symbol, condition, right = key
 
-        if row:
-            options_symbol = row[0]
-            options_expiration = row[1]
-            options_strike = row[2]
-            options_right = row[3]
-            number_of_contracts = row[4]
+        print("{} | Closing out {}, {}".format(
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), key, reason))
 
-            found_contract = create_options_contract(options_symbol, options_expiration, options_strike, options_right)
-            self.ib.qualifyContracts(found_contract)
+        await self.record_trade([
+            persistence.delete_option_statement(symbol, condition, right),
+            persistence.update_trade_stats_statement("L", condition, symbol, right),
+            persistence.update_trade_statement("L", condition, symbol, 0, 0, 0, 0, 0, 0, right,
+                                               datetime.datetime.now())
+        ])
+
+    def watch_fills(self):
+        self.ib.execDetailsEvent += self.on_exec_details
+
+    def on_exec_details(self, trade, fill):
+        position = self.positions.record_fill(trade.order.orderId, fill.execution.side, fill.execution.shares)
+
+        if position is not None:
+            print("{} | Filled {} {} of {}".format(
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), fill.execution.side,
+                fill.execution.shares, position))
+
+    async def sell_remaining_contracts_end_of_day(self):
+        open_positions = list(self.positions.items())
+
+        print(open_positions)
+
+        if not open_positions:
+            print("{} | No Contracts to Sell at the end of the day".format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))))
+            return
+
+        # Snapshot every remaining contract in one request rather than one round trip each
+        contracts = [position.contract for _, position in open_positions]
+        tickers = await self.get_tickers(*contracts)
+
+        ladder = self.get_ladder(tickers)
+
+        for index, ((key, position), ticker) in enumerate(zip(open_positions, tickers)):
+            try:
+                await self.sell_position_end_of_day(key, position, ticker, selection.ladder_row(ladder, index))
+            except Exception as e:
+                # The position stays in the book if it wasn't sold, the rest are still sold
+                print("{} | Failed selling {} at the end of the day: {}".format(
+                    time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), key, e))
+
+    async def sell_position_end_of_day(self, key, position, ticker, greeks_row):
+        options_symbol, options_condition, options_right = key
+        contract = position.contract
+
+        # Sold by a signal while the tickers were being requested
+        if self.positions.get(key) is not position:
+            return
+
+        print("Contract:", contract)
+        print("Condition:", options_condition)
+
+        ask = ticker.ask
+        bid = greeks_row['bid']
+        delta = greeks_row['delta']
+        gamma = greeks_row['gamma']
+        theta = greeks_row['theta']
+        implied_vol = greeks_row['iv']
+
+        sell_limit_order = LimitOrder(constants.SELL, position.quantity, ask)
+        sell_trade = self.ib.placeOrder(contract, sell_limit_order)
+        self.positions.close(key)
+        sell_time = datetime.datetime.now()
+
+        print("{} | Trade: {}".format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), sell_trade))
+        print("{} | Successfully Sold Trade".format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))))
+
+        # The buy price is on the position, so a database outage can't hold up
+        # the positions still to be sold
+        trade_ask_price = position.buy_ask
+
+        if trade_ask_price is None:
+            # Without the buy price there's no telling whether it won, so the trade is left pending
+            print("{} | No buy price for {}, leaving its result pending".format(
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), key))
+            result = "P"
+        elif options_right == constants.CALL:
+            if trade_ask_price > ask:
+                result = "L"
+            else:
+                result = "W"
         else:
-            print("{} | No contract found in database".format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))))
-            return None, None
+            if trade_ask_price > ask:
+                result = "W"
+            else:
+                result = "L"
 
-        return found_contract, number_of_contracts
+        await self.record_trade([
+            persistence.delete_option_statement(options_symbol, options_condition, options_right),
+            persistence.update_trade_stats_statement(result, options_condition, options_symbol, options_right),
+            persistence.update_trade_statement(result, options_condition, options_symbol, ask, bid, delta,
+                                               gamma, theta, implied_vol, options_right, sell_time)
+        ])
 
     async def check_connection(self):
         """
         Check IB Connection
         """
-        if not self.ib.isConnected() or not self.ib.client.isConnected():
+        async with self.connection_lock:
+            if self.ib.isConnected() and self.ib.client.isConnected():
+                return
+
             print("Attempting Reconnection to Interactive Brokers...")
             self.ib.disconnect()
             self.ib = IB()
-            self.ib.connect('127.0.0.1', config.interactive_brokers_port, clientId=1)
+            await self.ib.connectAsync('127.0.0.1', config.interactive_brokers_port, clientId=1,
+                                       timeout=config.IB_REQUEST_TIMEOUT)
             print("{} | Reconnected to Interactive Brokers".format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))))
 
+            self.watch_fills()
+            self.reset_streaming_subscriptions()
+            await self.reconcile_positions()
+
     async def update_options_chains(self):
         """
         Update Option Chains
@@ -871,21 +1328,20 @@ class OptionsBot:
         try:
             self.schedule.print_jobs()
             print("{} | Updating Option Chains".format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))))
-            self.amazon_option_chains = self.ib.reqSecDefOptParams(
-                self.amazon_stock_contract.symbol, '',
-                self.amazon_stock_contract.secType,
-                self.amazon_stock_contract.conId)
-            self.nvidia_option_chains = self.ib.reqSecDefOptParams(
-                self.nvidia_stock_contract.symbol, '',
-                self.nvidia_stock_contract.secType,
-                self.nvidia_stock_contract.conId)
-            self.apple_option_chains = self.ib.reqSecDefOptParams(
-                self.apple_stock_contract.symbol, '',
-                self.apple_stock_contract.secType,
-                self.apple_stock_contract.conId)
+            # Build the new registry first so signals keep using the old one until it's swapped in
+            self.option_chains = await self.load_option_chains()
+            self.save_snapshot()
         except Exception as e:
             print(str(e))
 
+        self.evict_expired_options_contracts()
+        await self.close_expired_positions()
+        await self.prewarm_options_contracts()
+
+        # The traded expiration may have rolled, so centre every ladder again
+        self.streaming_ladder_bounds = {}
+        await self.sync_streaming_ladders()
+
 
 # start the options bot
 OptionsBot()
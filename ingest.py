@@ -0,0 +1,112 @@
+"""
+    Async server for TradingView's webhooks, in place of the Flask app's
+    /tradingview route when alerts come in faster than one at a time.
+
+    Every alert is validated before it's accepted.  The alerts arriving
+    together are published to redis in one pipelined round trip, and each
+    webhook is only answered once its alert is in redis, so an accepted
+    alert is never lost.
+
+        python ingest.py
+"""
+import asyncio
+import time
+
+import redis.asyncio
+from aiohttp import web
+
+import config
+import signals
+
+
+class SignalPublisher:
+    """
+        Publishes alerts in batches.  An alert waits for the batch in flight,
+        which is all the batching delay there is, so a lone alert goes out
+        straight away and a burst shares round trips.
+    """
+    def __init__(self, client, batch_size):
+        self.client = client
+        self.batch_size = batch_size
+        self.queue = asyncio.Queue()
+        self.publisher_task = None
+
+    def start(self):
+        self.publisher_task = asyncio.create_task(self.publish_batches())
+
+    async def stop(self):
+        self.publisher_task.cancel()
+
+    async def publish(self, data):
+        published = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((data, published))
+        await published
+
+    async def publish_batches(self):
+        while True:
+            batch = [await self.queue.get()]
+
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            try:
+                async with self.client.pipeline(transaction=False) as pipe:
+                    for data, _ in batch:
+                        signals.publish_signal(pipe, data)
+                    await pipe.execute()
+            except Exception as e:
+                print("{} | Failed publishing {} alert(s): {}".format(
+                    time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), len(batch), e))
+                for _, published in batch:
+                    if not published.done():
+                        published.set_exception(e)
+                continue
+
+            for _, published in batch:
+                if not published.done():
+                    published.set_result(None)
+
+
+async def alert(request):
+    """
+        Validates a TradingView alert and publishes it for the bot.  Answers
+        400 for a malformed alert and 503 if redis couldn't take it, so
+        TradingView's webhook shows the failure.
+    """
+    data = await request.read()
+
+    try:
+        signals.validate_alert(data)
+    except ValueError as err:
+        return web.json_response({'error': str(err)}, status=400)
+
+    try:
+        await request.app['publisher'].publish(data)
+    except Exception:
+        return web.json_response({'error': "Couldn't publish alert"}, status=503)
+
+    return web.Response(body=data, content_type='application/json')
+
+
+async def start_publisher(app):
+    app['redis'] = redis.asyncio.Redis(host='localhost', port=config.redis_port, db=0)
+    app['publisher'] = SignalPublisher(app['redis'], config.INGEST_BATCH_SIZE)
+    app['publisher'].start()
+
+
+async def stop_publisher(app):
+    await app['publisher'].stop()
+    await app['redis'].close()
+
+
+def create_app():
+    app = web.Application(client_max_size=config.INGEST_MAX_ALERT_BYTES)
+    app.router.add_post('/tradingview', alert)
+    app.on_startup.append(start_publisher)
+    app.on_cleanup.append(stop_publisher)
+
+    return app
+
+
+if __name__ == "__main__":
+    web.run_app(create_app(), port=config.INGEST_PORT, access_log=None)
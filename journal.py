@@ -0,0 +1,144 @@
+"""
+    Append-only journal of the bot's trade events on local disk.  Every
+    BUY/SELL event is written and fsynced here before the signal is
+    acknowledged, then committed to MySQL by the write-behind writer.  Events
+    still in the journal at startup are replayed into MySQL, which skips any
+    it already has, so a crash or a database outage never loses a trade.
+    An event MySQL refuses is moved to a dead letter file instead, so it
+    neither keeps the journal from being emptied nor fails on every start.
+"""
+import asyncio
+import json
+import os
+import time
+import uuid
+
+
+def read_journal(path):
+    """
+        Events in the journal, oldest first.  A line torn by a crash while it
+        was being written is skipped, it was never acknowledged.
+    """
+    events = []
+
+    try:
+        with open(path, 'r') as journal_file:
+            for line in journal_file:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    print("Skipping incomplete journal entry in {}".format(path))
+    except FileNotFoundError:
+        pass
+
+    return events
+
+
+class TradeJournal:
+    def __init__(self, path, max_bytes, dead_letter_path):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.dead_letter_path = dead_letter_path
+        # Unbuffered and O_APPEND so each event is one write to the end of the file
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.size = os.fstat(self.fd).st_size
+        # Events written but not yet committed to MySQL
+        self.outstanding = 0
+        self.waiting = []
+        self.sync_needed = None
+        self.sync_task = None
+
+    def start(self):
+        self.sync_needed = asyncio.Event()
+        self.sync_task = asyncio.create_task(self.group_sync())
+
+    def write(self, event):
+        line = (json.dumps(event, default=str) + "\n").encode()
+        os.write(self.fd, line)
+        self.size += len(line)
+        self.outstanding += 1
+
+    async def append(self, statements):
+        """
+            Writes a trade event and waits until it's on disk.  Returns the
+            event to submit to the database.
+        """
+        event = {
+            'id': uuid.uuid4().hex,
+            'time': time.time(),
+            'statements': [[query, list(params)] for query, params in statements]
+        }
+
+        self.write(event)
+
+        synced = asyncio.get_running_loop().create_future()
+        self.waiting.append(synced)
+        self.sync_needed.set()
+        await synced
+
+        return event
+
+    async def group_sync(self):
+        """
+            One fsync for every event appended while the previous fsync was
+            running, so a burst of trades doesn't wait on one fsync each.
+        """
+        while True:
+            await self.sync_needed.wait()
+            self.sync_needed.clear()
+
+            waiting, self.waiting = self.waiting, []
+
+            try:
+                await asyncio.to_thread(os.fsync, self.fd)
+            except OSError as e:
+                for synced in waiting:
+                    synced.set_exception(e)
+                continue
+
+            for synced in waiting:
+                if not synced.done():
+                    synced.set_result(None)
+
+    def replay(self):
+        """
+            Events left in the journal by the last run, to submit to the
+            database again.
+        """
+        events = read_journal(self.path)
+        self.outstanding += len(events)
+
+        return events
+
+    def dead_letter(self, events):
+        """
+            Writes events the database refused to the dead letter file.
+            Returns whether they're safely there, only then can they be
+            counted as done.
+        """
+        try:
+            with open(self.dead_letter_path, 'a') as dead_letter_file:
+                for event in events:
+                    dead_letter_file.write(json.dumps(event, default=str) + "\n")
+                dead_letter_file.flush()
+                os.fsync(dead_letter_file.fileno())
+        except OSError as e:
+            print("Failed writing {} trade event(s) to {}: {}".format(len(events), self.dead_letter_path, e))
+            return False
+
+        print("{} | Moved {} trade event(s) MySQL refused to {}".format(
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), len(events), self.dead_letter_path))
+        return True
+
+    def committed(self, count):
+        """
+            Called by the database writer as events are committed.  Once
+            everything in the journal is in MySQL it's emptied, if it has
+            grown past max_bytes.
+        """
+        self.outstanding -= count
+
+        if self.outstanding == 0 and self.size > self.max_bytes and not self.waiting:
+            os.ftruncate(self.fd, 0)
+            os.fsync(self.fd)
+            self.size = 0
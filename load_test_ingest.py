@@ -0,0 +1,97 @@
+"""
+    Load test of the async ingest server.  Sends alerts from many concurrent
+    webhooks and reports throughput and latency percentiles, with a share
+    of malformed alerts to check they're turned away without slowing the
+    rest down.
+
+    Publishes to the signal stream or channel the bot reads, so point it at
+    a redis the bot isn't trading from.
+
+        python ingest.py
+        python load_test_ingest.py --alerts 20000 --concurrency 200
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+
+import aiohttp
+
+import config
+import constants
+
+
+def sample_alert(malformed=False):
+    symbol = random.choice(list(config.TRADED_SYMBOLS))
+    alert = {
+        'symbol': symbol,
+        'order': {
+            'condition': random.choice(config.TRADED_SYMBOLS[symbol]),
+            'price': round(random.uniform(50, 500), 2),
+            'stoploss': 0,
+            'takeProfit': 0,
+            'right': random.choice([constants.CALL, constants.PUT]),
+            'action': random.choice([constants.BUY, constants.SELL]),
+            'result': 'P'
+        }
+    }
+
+    if malformed:
+        del alert['order'][random.choice(list(alert['order']))]
+
+    return json.dumps(alert).encode()
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+async def send_alerts(session, url, alerts, latencies, statuses):
+    for alert in alerts:
+        started = time.perf_counter()
+        async with session.post(url, data=alert, headers={'Content-Type': 'application/json'}) as response:
+            await response.read()
+        latencies.append(time.perf_counter() - started)
+        statuses[response.status] = statuses.get(response.status, 0) + 1
+
+
+async def run(url, total, concurrency, malformed_share):
+    alerts = [sample_alert(random.random() < malformed_share) for _ in range(total)]
+    latencies = []
+    statuses = {}
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*[
+            send_alerts(session, url, alerts[worker::concurrency], latencies, statuses)
+            for worker in range(concurrency)
+        ])
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+
+    print("Sent {} alert(s) from {} concurrent webhooks in {:.2f}s".format(total, concurrency, elapsed))
+    print("Throughput: {:.0f} alerts/s".format(total / elapsed))
+    print("Latency:    p50 {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms, mean {:.2f} ms".format(
+        percentile(latencies, 0.50) * 1000, percentile(latencies, 0.99) * 1000, latencies[-1] * 1000,
+        statistics.mean(latencies) * 1000))
+    print("Responses:  {}".format(", ".join("{} x {}".format(count, status)
+                                            for status, count in sorted(statuses.items()))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default="http://127.0.0.1:{}/tradingview".format(config.INGEST_PORT))
+    parser.add_argument('--alerts', type=int, default=20000, help="alerts to send")
+    parser.add_argument('--concurrency', type=int, default=200, help="webhooks sending at once")
+    parser.add_argument('--malformed', type=float, default=0.05, help="share of alerts that are malformed")
+    args = parser.parse_args()
+
+    asyncio.run(run(args.url, args.alerts, args.concurrency, args.malformed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+    Versioned changes to the database schema.  tables.py creates the tables
+    as they first were, the migrations here are applied to them in order and
+    each version is recorded in schema_migrations, so a migration runs once
+    per database no matter how many times the bot starts.
+
+    Can be run on its own to migrate a database before starting the bot:
+
+        python migrations.py
+"""
+import time
+
+import mysql.connector
+from mysql.connector import errorcode
+
+import config
+import tables
+
+CREATE_SCHEMA_MIGRATIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version             INT NOT NULL,
+        description         VARCHAR(100) NOT NULL,
+        applied_timestamp   TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (version)
+    )
+"""
+
+RETRIEVE_APPLIED_MIGRATIONS = """SELECT version FROM schema_migrations"""
+INSERT_MIGRATION = """INSERT INTO schema_migrations (version, description) VALUES (%s, %s)"""
+
+# (version, description, statements), in the order they're applied
+MIGRATIONS = [
+    (1, "Index open trades and trades by buy time", [
+        # GET/UPDATE of a symbol's open trade and the ask price lookup filter on these
+        "ALTER TABLE trade ADD INDEX trade_symbol_condition_result (symbol, trade_condition, result)",
+        # Dashboard and export date ranges
+        "ALTER TABLE trade ADD INDEX trade_buy_timestamp (buy_timestamp)"
+    ]),
+    (2, "Index options contracts by symbol and condition", [
+        "ALTER TABLE options ADD INDEX options_symbol_condition (symbol, trade_condition)"
+    ]),
+    (3, "Roll up trade counters per day, symbol and condition", [
+        tables.CREATE_TRADE_STATS_TABLE,
+        # Emptied first so a backfill interrupted part way through can run again
+        "DELETE FROM trade_stats_daily",
+        tables.BACKFILL_TRADE_STATS
+    ]),
+    (4, "Track when each trade last changed", [
+        # Existing trades all start out changed at the time of the migration
+        "ALTER TABLE trade ADD COLUMN updated_timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP "
+        "ON UPDATE CURRENT_TIMESTAMP",
+        "ALTER TABLE trade ADD INDEX trade_updated_timestamp (updated_timestamp)"
+    ])
+]
+
+# An index or column left behind by a migration that failed part way through
+IGNORED_ERRORS = {
+    errorcode.ER_DUP_KEYNAME,
+    errorcode.ER_DUP_FIELDNAME
+}
+
+
+def migrate(cnx, migrations=MIGRATIONS):
+    """
+        Applies every migration the database doesn't have yet.  MySQL commits
+        DDL as it runs, so each migration is recorded as soon as it's done
+        and a failure leaves the earlier ones in place.
+    """
+    cursor = cnx.cursor()
+    cursor.execute(CREATE_SCHEMA_MIGRATIONS_TABLE)
+    cursor.execute(RETRIEVE_APPLIED_MIGRATIONS)
+    applied = {row[0] for row in cursor.fetchall()}
+
+    for version, description, statements in migrations:
+        if version in applied:
+            continue
+
+        started = time.perf_counter()
+
+        for statement in statements:
+            try:
+                cursor.execute(statement)
+            except mysql.connector.Error as err:
+                if err.errno not in IGNORED_ERRORS:
+                    raise
+                print("Migration {} already partly applied: {}".format(version, err))
+
+        cursor.execute(INSERT_MIGRATION, (version, description))
+        cnx.commit()
+
+        print("{} | Applied migration {}: {} ({:.2f}s)".format(
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), version, description,
+            time.perf_counter() - started))
+
+    cursor.close()
+
+
+if __name__ == "__main__":
+    connection = mysql.connector.connect(**config.database_config)
+
+    try:
+        cursor = connection.cursor()
+        for create_table in [tables.CREATE_TRADE_TABLE, tables.CREATE_OPTIONS_TABLE,
+                             tables.CREATE_ACCOUNT_SUMMARY_TABLE, tables.CREATE_JOURNAL_EVENTS_TABLE]:
+            cursor.execute(create_table)
+        cursor.close()
+
+        migrate(connection)
+    finally:
+        connection.close()
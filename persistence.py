@@ -0,0 +1,286 @@
+"""
+    MySQL access for the bot through a connection pool.  A trade's writes
+    are queued together and committed by a background writer, so placing an
+    order never waits on the database, and a burst of trades is committed
+    in one transaction.  Each trade is a journal event and its id is
+    recorded in the same transaction, so replaying the journal never writes
+    a trade twice.
+"""
+import asyncio
+import time
+
+import mysql.connector
+import mysql.connector.pooling
+from mysql.connector import errorcode
+
+import migrations
+import tables
+
+# Errors that mean the database couldn't be reached rather than a bad statement
+RETRYABLE_ERRORS = (
+    mysql.connector.errors.InterfaceError,
+    mysql.connector.errors.OperationalError,
+    mysql.connector.errors.PoolError
+)
+
+# Errors a transaction can hit under lock contention, which succeed when retried
+RETRYABLE_ERRNOS = (errorcode.ER_LOCK_DEADLOCK, errorcode.ER_LOCK_WAIT_TIMEOUT)
+
+
+def is_retryable(err):
+    return isinstance(err, RETRYABLE_ERRORS) or getattr(err, 'errno', None) in RETRYABLE_ERRNOS
+
+
+def insert_trade_statement(message_data, number_of_contracts, strike_price, ask, bid, gamma, delta, theta,
+                           implied_vol, buy_time):
+    """
+        buy_time is bound rather than left to the database, so a trade
+        replayed from the journal keeps the time it was made.
+    """
+    return tables.INSERT_TRADE_DATA, (
+        message_data['symbol'],
+        message_data['order']['condition'],
+        message_data['order']['action'],
+        message_data['order']['right'],
+        number_of_contracts,
+        message_data['order']['price'],
+        strike_price,
+        message_data['order']['stoploss'],
+        message_data['order']['takeProfit'],
+        delta,
+        gamma,
+        theta,
+        ask,
+        bid,
+        implied_vol,
+        message_data['order']['result'],
+        buy_time
+    )
+
+
+def insert_trade_stats_statement(message_data, buy_time):
+    right = message_data['order']['right']
+    result = message_data['order']['result']
+
+    return tables.INSERT_TRADE_STATS, (
+        buy_time, message_data['symbol'], message_data['order']['condition'], right, right, result, result, result)
+
+
+def update_trade_stats_statement(result, condition, symbol, right):
+    """
+        Has to come before the update_trade_statement of the same sell, it
+        counts the trades that are still pending.
+    """
+    return tables.UPDATE_TRADE_STATS, (result, result, result, condition, symbol, right)
+
+
+def update_trade_statement(result, condition, symbol, sell_ask, sell_bid, sell_delta, sell_gamma, sell_theta,
+                           sell_implied_vol, right, sell_time):
+    """
+        Closes the pending trade of a symbol, condition and right, right as
+        'CALL'/'PUT' like the trade table stores it.
+    """
+    return tables.UPDATE_TRADE_DATA, (
+        result, sell_delta, sell_gamma, sell_theta, sell_ask, sell_bid, sell_implied_vol, sell_time, condition, symbol,
+        right)
+
+
+def insert_option_statement(condition, contract, number_of_contracts):
+    return tables.INSERT_OPTION_DATA, (
+        condition,
+        contract.symbol,
+        contract.lastTradeDateOrContractMonth,
+        contract.strike,
+        contract.right,
+        contract.exchange,
+        contract.tradingClass,
+        number_of_contracts
+    )
+
+
+def delete_option_statement(symbol, condition, right):
+    """
+        Deletes the options contract of a symbol, condition and right, right
+        as 'CALL'/'PUT' or 'C'/'P'.
+    """
+    return tables.DELETE_OPTION_DATA, (symbol, condition, right[0])
+
+
+class TradeDatabase:
+    def __init__(self, database_config, pool_size, batch_size, retry_delay, journal=None):
+        self.pool = mysql.connector.pooling.MySQLConnectionPool(
+            pool_name="options-bot",
+            pool_size=pool_size,
+            **database_config
+        )
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        self.journal = journal
+        self.queue = None
+        self.writer_task = None
+
+    def get_connection(self):
+        cnx = self.pool.get_connection()
+
+        if not cnx.is_connected():
+            print("Attempting Reconnection to MySQL Database...")
+            cnx.reconnect(attempts=3, delay=1)
+
+        return cnx
+
+    def execute_now(self, statements):
+        """
+            Runs statements in one transaction on the calling thread, for
+            startup before the writer is running.
+        """
+        cnx = self.get_connection()
+
+        try:
+            cursor = cnx.cursor()
+            for query, params in statements:
+                cursor.execute(query, params)
+            cnx.commit()
+            cursor.close()
+        finally:
+            cnx.close()
+
+    def migrate(self):
+        cnx = self.get_connection()
+
+        try:
+            migrations.migrate(cnx)
+        finally:
+            cnx.close()
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.writer_task = asyncio.create_task(self.write_behind())
+
+    def submit(self, event):
+        """
+            Queues a journal event's statements to be committed together,
+            without waiting for them.
+        """
+        self.queue.put_nowait(event)
+
+    async def flush(self):
+        """
+            Waits until everything submitted so far is committed, so a read
+            sees the trades written before it.
+        """
+        await self.queue.join()
+
+    async def write_behind(self):
+        while True:
+            batch = [await self.queue.get()]
+
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            # Keep the trades not yet committed until the database is back, rather than dropping them
+            pending = list(batch)
+            failed = []
+            while True:
+                try:
+                    await asyncio.to_thread(self.commit_batch, pending, failed)
+                    break
+                except Exception as err:
+                    # Anything else is unexpected, but the writer must keep
+                    # running or every trade after it is lost
+                    reason = "Database unavailable" if is_retryable(err) else "Unexpected error committing trades"
+                    print("{} | {}, retrying {} trade(s): {}".format(
+                        time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), reason, len(pending), err))
+                    await asyncio.sleep(self.retry_delay)
+
+            # Failed trades are done once they're in the dead letter file, if
+            # they can't be put there they stay in the journal for replay
+            if self.journal is not None:
+                done = len(batch)
+                if failed and not self.journal.dead_letter(failed):
+                    done -= len(failed)
+                self.journal.committed(done)
+
+            for _ in batch:
+                self.queue.task_done()
+
+    @staticmethod
+    def apply_event(cursor, event):
+        """
+            Runs the event's statements, unless its id shows it was
+            committed before.
+        """
+        cursor.execute(tables.INSERT_JOURNAL_EVENT, (event['id'],))
+
+        if cursor.rowcount == 0:
+            print("Skipping trade event {}, already in Database".format(event['id']))
+            return
+
+        for query, params in event['statements']:
+            cursor.execute(query, params)
+
+    def commit_batch(self, batch, failed):
+        """
+            Commits every trade in the batch in one transaction.  If a bad
+            trade fails it, the trades are committed one at a time so only
+            the bad one is left out, and added to failed.  Connection
+            errors, deadlocks and lock wait timeouts are raised for the
+            writer to retry what's left of the batch.
+        """
+        cnx = self.get_connection()
+
+        try:
+            cursor = cnx.cursor()
+
+            try:
+                for event in batch:
+                    self.apply_event(cursor, event)
+                cnx.commit()
+                print("{} | Successfully committed {} trade(s) to Database!".format(
+                    time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())), len(batch)))
+                return
+            except Exception as err:
+                cnx.rollback()
+                if is_retryable(err):
+                    raise
+                print("Failed committing {} trade(s) together, committing one at a time: {}".format(len(batch), err))
+
+            # Trades are removed from the batch as they're done, so a retry
+            # doesn't commit any of them twice
+            while batch:
+                event = batch[0]
+                try:
+                    self.apply_event(cursor, event)
+                    cnx.commit()
+                except Exception as err:
+                    # Anything but a retryable database error is the trade's
+                    # own fault, so only it is left out
+                    cnx.rollback()
+                    if is_retryable(err):
+                        raise
+                    print("Failed committing trade to database: {} {}".format(event, err))
+                    failed.append(event)
+                batch.pop(0)
+
+            cursor.close()
+        finally:
+            cnx.close()
+
+    def fetch(self, query, params, fetch_all):
+        cnx = self.get_connection()
+
+        try:
+            cursor = cnx.cursor(buffered=True)
+            cursor.execute(query, params)
+            rows = cursor.fetchall() if fetch_all else cursor.fetchone()
+            cursor.close()
+            return rows
+        finally:
+            cnx.close()
+
+    async def fetchone(self, query, params=()):
+        await self.flush()
+        return await asyncio.to_thread(self.fetch, query, params, False)
+
+    async def fetchall(self, query, params=()):
+        await self.flush()
+        return await asyncio.to_thread(self.fetch, query, params, True)
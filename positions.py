@@ -0,0 +1,140 @@
+"""
+    In-memory book of the bot's open options positions, keyed by
+    (symbol, condition, right) like the signals that open and close them.
+    Rebuilt at startup from the options table and checked against the
+    positions IB reports, then kept up to date by fills, so selling a
+    position needs nothing from the database or IB before placing the order.
+"""
+import constants
+
+
+def position_key(symbol, condition, right):
+    """
+        Book key of a position, right as the signal sends it, 'CALL'/'PUT',
+        whether it's given that way or as IB's 'C'/'P'.
+    """
+    return symbol, condition, constants.CALL if right.upper().startswith('C') else constants.PUT
+
+
+class Position:
+    def __init__(self, contract, ordered, buy_ask=None):
+        self.contract = contract
+        # Contracts the BUY order was placed for, and how many of them have filled
+        self.ordered = ordered
+        self.filled = None
+        # Ask the BUY was placed at, to judge the sell against, None if unknown
+        self.buy_ask = buy_ask
+
+    @property
+    def quantity(self):
+        """
+            Contracts to sell, what's filled once IB has reported any fills,
+            what was ordered until then.
+        """
+        return self.ordered if self.filled is None else self.filled
+
+    def __repr__(self):
+        return "Position({}, ordered={}, filled={}, buy_ask={})".format(self.contract, self.ordered, self.filled,
+                                                                       self.buy_ask)
+
+
+class PositionBook:
+    def __init__(self):
+        self.positions = {}
+        # Book key of each BUY order, so its fills find their position
+        self.order_keys = {}
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, key):
+        return key in self.positions
+
+    def items(self):
+        return self.positions.items()
+
+    def get(self, key):
+        return self.positions.get(key)
+
+    def open(self, key, contract, quantity, order_id=None, buy_ask=None):
+        position = Position(contract, quantity, buy_ask)
+        self.positions[key] = position
+
+        if order_id is not None:
+            self.order_keys[order_id] = key
+
+        return position
+
+    def close(self, key):
+        """
+            Removes the position and returns it, or None if there's no open
+            position with that key.
+        """
+        position = self.positions.pop(key, None)
+
+        if position is not None:
+            self.forget_orders(key)
+
+        return position
+
+    def forget_orders(self, key):
+        for order_id in [order_id for order_id, order_key in self.order_keys.items() if order_key == key]:
+            del self.order_keys[order_id]
+
+    def record_fill(self, order_id, side, shares):
+        """
+            Applies a fill of one of the book's BUY orders.  Returns the
+            position it filled, or None if the order isn't one of the book's.
+        """
+        key = self.order_keys.get(order_id)
+        position = self.positions.get(key)
+
+        if position is None:
+            return None
+
+        if position.filled is None:
+            position.filled = 0
+
+        position.filled += shares if side == 'BOT' else -shares
+
+        return position
+
+    def has_working_buy(self, key, position, working_buys):
+        """
+            Whether a BUY order for the position is still working, by the
+            book's order ids or, for positions loaded from the database, by
+            the contract.
+        """
+        if any(order_key == key and order_id in working_buys for order_id, order_key in self.order_keys.items()):
+            return True
+
+        return position.contract.conId in working_buys.values()
+
+    def reconcile(self, broker_positions, working_buys):
+        """
+            Checks the book against the positions IB reports, as
+            {conId: contracts held}, and the BUY orders still working, as
+            {orderId: conId}.  A position IB doesn't hold is dropped, and one
+            IB holds fewer contracts of than the book is cut down to what IB
+            holds, unless its BUY order is still working and it may yet fill.
+            Returns the keys that changed.
+        """
+        remaining = dict(broker_positions)
+        changed = []
+
+        for key, position in list(self.positions.items()):
+            held = remaining.get(position.contract.conId, 0)
+
+            if self.has_working_buy(key, position, working_buys):
+                pass
+            elif held <= 0:
+                self.close(key)
+                changed.append(key)
+            elif held < position.quantity:
+                position.filled = held
+                changed.append(key)
+
+            # Several conditions can hold the same contract, each takes its own share
+            remaining[position.contract.conId] = held - position.quantity
+
+        return changed
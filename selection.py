@@ -0,0 +1,116 @@
+"""
+    Chooses which options contract to buy from a ladder of candidates.  The
+    quotes and greeks of the whole ladder are loaded into arrays once, so
+    masking and scoring cost about the same for 8 candidates or 80.
+"""
+import numpy
+
+import constants
+
+
+def to_array(values):
+    return numpy.array([numpy.nan if value is None else value for value in values], dtype=float)
+
+
+def ladder_arrays(tickers):
+    """
+        Quotes and ask greeks of a ladder of tickers as arrays, along with
+        what the contracts are.  Anything IB hasn't sent is NaN, including
+        the -1 it uses for a missing bid/ask.
+    """
+    ask_greeks = [ticker.askGreeks for ticker in tickers]
+    bid = to_array([ticker.bid for ticker in tickers])
+    ask = to_array([ticker.ask for ticker in tickers])
+
+    return {
+        'bid': numpy.where(bid > 0, bid, numpy.nan),
+        'ask': numpy.where(ask > 0, ask, numpy.nan),
+        'delta': to_array([greeks.delta if greeks else None for greeks in ask_greeks]),
+        'gamma': to_array([greeks.gamma if greeks else None for greeks in ask_greeks]),
+        'theta': to_array([greeks.theta if greeks else None for greeks in ask_greeks]),
+        'iv': to_array([greeks.impliedVol if greeks else None for greeks in ask_greeks]),
+        # Underlying price IB computed its greeks with
+        'und_price': to_array([greeks.undPrice if greeks else None for greeks in ask_greeks]),
+        'strike': to_array([ticker.contract.strike for ticker in tickers]),
+        'is_call': numpy.array([ticker.contract.right.startswith('C') for ticker in tickers]),
+        'symbol': [ticker.contract.symbol for ticker in tickers],
+        'expiration': [ticker.contract.lastTradeDateOrContractMonth for ticker in tickers]
+    }
+
+
+def ladder_row(ladder, index):
+    """
+        Quotes and greeks of one contract in the ladder, NaN as None so they
+        can be saved to the database.
+    """
+    row = {}
+
+    for name in ['bid', 'ask', 'delta', 'gamma', 'theta', 'iv']:
+        value = ladder[name][index]
+        row[name] = None if numpy.isnan(value) else float(value)
+
+    return row
+
+
+def delta_in_bounds(delta, right, margin=0.0):
+    """
+        Which deltas are inside the CALL_/PUT_*_DELTA_BOUNDARY for the right,
+        with the boundaries widened by margin.
+    """
+    if right == 'C':
+        return ((delta > constants.CALL_LOWER_DELTA_BOUNDARY - margin) &
+                (delta < constants.CALL_UPPER_DELTA_BOUNDARY + margin))
+
+    return ((delta > constants.PUT_UPPER_DELTA_BOUNDARY - margin) &
+            (delta < constants.PUT_LOWER_DELTA_BOUNDARY + margin))
+
+
+def score_ladder(ladder, right, weights):
+    """
+        Scores every contract in the ladder, lower is better.  Contracts with
+        a delta outside the CALL_/PUT_*_DELTA_BOUNDARY for the right, or
+        missing a value the score needs, score infinity.
+
+        Parameters:
+            ladder: Arrays from ladder_arrays.
+            right: 'C' or 'P'.
+            weights: Weight of each term of the score, terms weighted 0
+                are left out:
+                delta  - distance from SET_DELTA_COMPARISON
+                spread - bid/ask spread as a fraction of the mid price
+                theta  - daily time decay as a fraction of the mid price
+                iv     - implied volatility
+    """
+    delta = ladder['delta']
+    in_bounds = delta_in_bounds(delta, right)
+    target_delta = constants.SET_DELTA_COMPARISON if right == 'C' else -constants.SET_DELTA_COMPARISON
+
+    mid = (ladder['bid'] + ladder['ask']) / 2
+    terms = {
+        'delta': lambda: numpy.abs(delta - target_delta),
+        'spread': lambda: (ladder['ask'] - ladder['bid']) / mid,
+        'theta': lambda: numpy.abs(ladder['theta']) / mid,
+        'iv': lambda: ladder['iv']
+    }
+
+    score = numpy.zeros(len(delta))
+
+    for term, weight in weights.items():
+        if weight:
+            score += weight * terms[term]()
+
+    return numpy.where(in_bounds & numpy.isfinite(score), score, numpy.inf)
+
+
+def best_contract_index(ladder, right, weights):
+    """
+        Index of the best scoring contract in the ladder, or None if none of
+        them are inside the delta boundaries.
+    """
+    score = score_ladder(ladder, right, weights)
+    index = int(numpy.argmin(score))
+
+    if numpy.isinf(score[index]):
+        return None
+
+    return index
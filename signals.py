@@ -0,0 +1,66 @@
+"""
+    TradingView alerts as the bot expects them.  Shared by the Flask app and
+    the async ingest server, so an alert is checked the same way whichever
+    one receives it, and a malformed one never reaches the bot.
+"""
+import json
+
+import config
+import constants
+
+# Fields of the alert's order and what each has to be
+ORDER_FIELDS = {
+    'condition': str,
+    'price': (int, float),
+    'stoploss': (int, float),
+    'takeProfit': (int, float),
+    'right': (constants.CALL, constants.PUT),
+    'action': (constants.BUY, constants.SELL),
+    'result': ('W', 'L', 'P')
+}
+
+
+def validate_alert(data):
+    """
+        Parses and checks an alert in one pass over its fields.  Returns the
+        alert, or raises ValueError saying what's wrong with it.
+    """
+    try:
+        alert = json.loads(data)
+    except (TypeError, ValueError) as e:
+        raise ValueError("Alert isn't valid JSON: {}".format(e))
+
+    if not isinstance(alert, dict):
+        raise ValueError("Alert must be a JSON object")
+
+    if not isinstance(alert.get('symbol'), str) or not alert['symbol']:
+        raise ValueError("Alert is missing its symbol")
+
+    order = alert.get('order')
+    if not isinstance(order, dict):
+        raise ValueError("Alert is missing its order")
+
+    for field, expected in ORDER_FIELDS.items():
+        value = order.get(field)
+
+        if isinstance(expected, tuple) and not isinstance(expected[0], type):
+            if value not in expected:
+                raise ValueError("order.{} must be one of {}, not {!r}".format(field, ", ".join(expected), value))
+        # bool is an int, but never a valid price
+        elif not isinstance(value, expected) or isinstance(value, bool):
+            raise ValueError("order.{} is missing or has the wrong type: {!r}".format(field, value))
+
+    return alert
+
+
+def publish_signal(client, data):
+    """
+        Hands the alert to the bot with a redis client or pipeline, on the
+        durable signal stream or the pub/sub channel depending on
+        config.SIGNAL_INGEST_MODE.
+    """
+    if config.SIGNAL_INGEST_MODE == constants.STREAM:
+        return client.xadd(constants.SIGNAL_STREAM, {'data': data}, maxlen=config.SIGNAL_STREAM_MAXLEN,
+                           approximate=True)
+
+    return client.publish(constants.TRADINGVIEW_CHANNEL, data)
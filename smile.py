@@ -0,0 +1,93 @@
+"""
+    Implied volatility smile of one underlying and expiration, fitted
+    incrementally from the quotes the bot already receives.  Gives an
+    implied volatility, and so model greeks, for any strike in the chain
+    without asking IB for market data on it.
+"""
+import time
+
+import numpy
+
+import greeks
+
+
+class VolatilitySmile:
+    """
+        Weighted least squares fit of implied volatility against log
+        moneyness, x = ln(strike / underlying price):
+
+            iv = a + b * x + c * x^2
+
+        The fit is kept as running sums of x^k and x^k * iv.  The sums decay
+        with a half life, so every quote updates the smile in constant time
+        and old quotes fade out as the smile moves.
+    """
+    def __init__(self, half_life):
+        self.half_life = half_life
+        # sum of w * x^k for k = 0..4 and of w * x^k * iv for k = 0..2
+        self.moments = numpy.zeros(5)
+        self.weighted_iv = numpy.zeros(3)
+        self.lowest_moneyness = numpy.inf
+        self.highest_moneyness = -numpy.inf
+        self.updated_at = None
+        self.coefficients = None
+
+    @property
+    def weight(self):
+        """
+            Decayed number of quotes behind the fit.
+        """
+        return self.moments[0]
+
+    def decay(self, now):
+        if self.updated_at is not None:
+            factor = 0.5 ** ((now - self.updated_at) / self.half_life)
+            self.moments *= factor
+            self.weighted_iv *= factor
+
+        self.updated_at = now
+
+    def update(self, log_moneyness, implied_vol, now=None):
+        """
+            Adds quotes to the fit.  Quotes without a positive implied
+            volatility are ignored.
+        """
+        x = numpy.asarray(log_moneyness, dtype=float)
+        iv = numpy.asarray(implied_vol, dtype=float)
+        valid = numpy.isfinite(x) & numpy.isfinite(iv) & (iv > 0)
+
+        if not valid.any():
+            return
+
+        self.decay(now or time.time())
+
+        x = x[valid]
+        iv = iv[valid]
+        powers = x[:, None] ** numpy.arange(5)
+
+        self.moments += powers.sum(axis=0)
+        self.weighted_iv += (powers[:, :3] * iv[:, None]).sum(axis=0)
+        self.lowest_moneyness = min(self.lowest_moneyness, x.min())
+        self.highest_moneyness = max(self.highest_moneyness, x.max())
+        self.coefficients = None
+
+    def fit(self):
+        normal_matrix = numpy.array([self.moments[row:row + 3] for row in range(3)])
+
+        # lstsq rather than solve, too few distinct strikes leaves the matrix singular
+        coefficients = numpy.linalg.lstsq(normal_matrix, self.weighted_iv, rcond=None)[0]
+
+        return coefficients
+
+    def implied_vol(self, log_moneyness):
+        """
+            Implied volatility from the smile.  Outside the strikes it was
+            fitted on the smile is held flat rather than extrapolated.
+        """
+        if self.coefficients is None:
+            self.coefficients = self.fit()
+
+        x = numpy.clip(numpy.asarray(log_moneyness, dtype=float), self.lowest_moneyness, self.highest_moneyness)
+        a, b, c = self.coefficients
+
+        return numpy.clip(a + b * x + c * x * x, greeks.MIN_VOLATILITY, greeks.MAX_VOLATILITY)
@@ -0,0 +1,65 @@
+"""
+    Warm-start snapshot of the bot's Interactive Brokers state: qualified
+    underlyings, option chains and qualified option contracts.  Written
+    whenever that state changes so a restart can start trading straight away
+    instead of asking IB for all of it again.  Open positions aren't in it,
+    they're rebuilt from the options table and checked against IB once the
+    bot is trading.
+"""
+import os
+import pickle
+import time
+
+SNAPSHOT_VERSION = 1
+
+
+def dump_snapshot(state):
+    """
+        Serialises the state on the caller's thread, so it's a consistent
+        copy even if the bot changes it while the file is being written.
+    """
+    return pickle.dumps({
+        'version': SNAPSHOT_VERSION,
+        'written_at': time.time(),
+        'state': state
+    }, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def write_snapshot(path, data):
+    """
+        Replaces the snapshot file in one step, a crash while writing leaves
+        the previous snapshot in place.
+    """
+    temporary_path = path + ".tmp"
+
+    with open(temporary_path, 'wb') as snapshot_file:
+        snapshot_file.write(data)
+        snapshot_file.flush()
+        os.fsync(snapshot_file.fileno())
+
+    os.replace(temporary_path, path)
+
+
+def load_snapshot(path, max_age):
+    """
+        Returns the state saved in the snapshot, or None if there isn't one
+        that can be used.
+    """
+    try:
+        with open(path, 'rb') as snapshot_file:
+            snapshot = pickle.load(snapshot_file)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print("Failed loading snapshot {}: {}".format(path, e))
+        return None
+
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        print("Ignoring snapshot {} written by a different version".format(path))
+        return None
+
+    if time.time() - snapshot['written_at'] > max_age:
+        print("Ignoring snapshot {}, it's older than {} seconds".format(path, max_age))
+        return None
+
+    return snapshot['state']
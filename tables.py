@@ -60,6 +60,16 @@ CREATE_ACCOUNT_SUMMARY_TABLE = """
     )
 """
 
+CREATE_JOURNAL_EVENTS_TABLE = """
+    CREATE TABLE IF NOT EXISTS journal_events (
+        event_id            CHAR(32) NOT NULL,
+        committed_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (event_id)
+    )
+"""
+
+INSERT_JOURNAL_EVENT = """INSERT IGNORE INTO journal_events (event_id) VALUES (%s)"""
+
 INSERT_TRADE_DATA = """
     INSERT INTO trade
         (
@@ -78,9 +88,10 @@ INSERT_TRADE_DATA = """
             buy_ask,
             buy_bid,
             buy_implied_vol,
-            result
+            result,
+            buy_timestamp
         ) 
-    VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
+    VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
 """
 
 UPDATE_TRADE_DATA = """
@@ -93,37 +104,54 @@ UPDATE_TRADE_DATA = """
         sell_ask = %s,
         sell_bid = %s, 
         sell_implied_vol = %s, 
-        sell_timestamp = CURRENT_TIMESTAMP
+        sell_timestamp = %s
     WHERE 
         trade_condition = %s AND 
         trade_action = 'BUY' AND 
         result = 'P' AND 
-        symbol = %s
+        symbol = %s AND 
+        trade_right = %s
 """
 
 DELETE_ALL_TRADE_DATA = """DELETE FROM trade"""
 
-RETRIEVE_TRADE_ASK_PRICE = """SELECT trade_right, buy_ask FROM trade WHERE symbol = %s and trade_condition = %s and result = 'P' LIMIT 1"""
-RETRIEVE_TRADE_DATA_TODAY = """SELECT * FROM trade WHERE DATE(buy_timestamp) = CURDATE()"""
+RETRIEVE_PENDING_TRADE_ASK_PRICES = """
+    SELECT symbol, trade_condition, trade_right, buy_ask FROM trade WHERE trade_action = 'BUY' and result = 'P'
+"""
+RETRIEVE_TRADE_ASK_PRICE = """
+    SELECT trade_right, buy_ask FROM trade WHERE symbol = %s and trade_condition = %s and trade_right = %s and result = 'P' LIMIT 1
+"""
+# Date filters are ranges on the bare buy_timestamp column so they can use its index
+RETRIEVE_TRADE_DATA_TODAY = """
+    SELECT * FROM trade WHERE buy_timestamp >= CURDATE() AND buy_timestamp < CURDATE() + INTERVAL 1 DAY
+"""
 RETRIEVE_TRADE_DATA_YESTERDAY = """
-    SELECT * FROM trade WHERE buy_timestamp > DATE_SUB(CURRENT_DATE, INTERVAL 1 DAY) and DATE(buy_timestamp) < CURDATE()
+    SELECT * FROM trade WHERE buy_timestamp >= CURDATE() - INTERVAL 1 DAY AND buy_timestamp < CURDATE()
+"""
+RETRIEVE_TRADE_CURRENT_MONTH = """
+    SELECT * FROM trade 
+        WHERE 
+            buy_timestamp >= CURDATE() - INTERVAL (DAYOFMONTH(CURDATE()) - 1) DAY AND 
+            buy_timestamp < CURDATE() - INTERVAL (DAYOFMONTH(CURDATE()) - 1) DAY + INTERVAL 1 MONTH
 """
-RETRIEVE_TRADE_CURRENT_MONTH = """ SELECT * FROM trade WHERE MONTH(buy_timestamp)=MONTH(now())"""
 
-GET_MATCHING_TRADE = """select contracts from trade where symbol = %s and trade_condition = %s and result = 'P' LIMIT 1"""
+# One page of trades bought in [%s, %s), in (buy_timestamp, id) order.  The
+# filters and TRADES_PAGE_AFTER are added between WHERE and ORDER BY, so a page
+# starts where the last one ended instead of OFFSET skipping the earlier pages.
+RETRIEVE_TRADES_PAGE = """
+    SELECT id, symbol, trade_condition, trade_right, contracts, result, buy_timestamp, sell_timestamp 
+        FROM trade 
+        WHERE buy_timestamp >= %s AND buy_timestamp < %s{filters} 
+        ORDER BY buy_timestamp, id 
+        LIMIT %s
+"""
+TRADES_PAGE_AFTER = """ AND (buy_timestamp > %s OR (buy_timestamp = %s AND id > %s))"""
 
 RETRIEVE_OPTION_ALL_REMAINING_CONTRACTS = """
     SELECT symbol, trade_condition, lastTradeDateOrContractMonth, strike, trade_right, contracts FROM options 
 """
-RETRIEVE_OPTION_CONTRACT = """
-    SELECT symbol, lastTradeDateOrContractMonth, strike, trade_right, contracts 
-        FROM options 
-        WHERE 
-            symbol = %s AND 
-            trade_condition = %s 
-        LIMIT 1
-"""
-DELETE_OPTION_DATA = """DELETE FROM options WHERE symbol = %s AND trade_condition = %s"""
+# options stores IB's 'C'/'P' rights, trade the signal's 'CALL'/'PUT'
+DELETE_OPTION_DATA = """DELETE FROM options WHERE symbol = %s AND trade_condition = %s AND LEFT(trade_right, 1) = %s"""
 INSERT_OPTION_DATA = """
     INSERT INTO options
         (
@@ -139,62 +167,155 @@ INSERT_OPTION_DATA = """
     VALUES(%s, %s, %s, %s, %s, %s, %s, %s);
 """
 
+# Trade counters per buy date, symbol and condition, kept up to date in the same
+# transaction as the trade so the dashboard never has to count trade rows
+CREATE_TRADE_STATS_TABLE = """
+    CREATE TABLE IF NOT EXISTS trade_stats_daily (
+        trade_date          DATE NOT NULL,
+        symbol              VARCHAR(10) NOT NULL,
+        trade_condition     VARCHAR(20) NOT NULL,
+        calls               INT NOT NULL DEFAULT 0,
+        puts                INT NOT NULL DEFAULT 0,
+        wins                INT NOT NULL DEFAULT 0,
+        losses              INT NOT NULL DEFAULT 0,
+        pending             INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (trade_date, symbol, trade_condition)
+    )
+"""
+
+BACKFILL_TRADE_STATS = """
+    INSERT INTO trade_stats_daily (trade_date, symbol, trade_condition, calls, puts, wins, losses, pending)
+        SELECT 
+            DATE(buy_timestamp), 
+            symbol, 
+            trade_condition, 
+            SUM(trade_right = 'CALL'), 
+            SUM(trade_right = 'PUT'), 
+            SUM(result = 'W'), 
+            SUM(result = 'L'), 
+            SUM(result = 'P')
+        FROM trade 
+        GROUP BY DATE(buy_timestamp), symbol, trade_condition
+"""
+
+# Counts a new trade, parameters: symbol, condition, right, right, result, result, result
+INSERT_TRADE_STATS = """
+    INSERT INTO trade_stats_daily (trade_date, symbol, trade_condition, calls, puts, wins, losses, pending)
+    VALUES(DATE(%s), %s, %s, %s = 'CALL', %s = 'PUT', %s = 'W', %s = 'L', %s = 'P')
+    ON DUPLICATE KEY UPDATE 
+        calls = calls + VALUES(calls), 
+        puts = puts + VALUES(puts), 
+        wins = wins + VALUES(wins), 
+        losses = losses + VALUES(losses), 
+        pending = pending + VALUES(pending)
+"""
+
+# Moves the trades UPDATE_TRADE_DATA is about to close out of pending, so it
+# must run before it.  Parameters: result, result, result, condition, symbol, right
+UPDATE_TRADE_STATS = """
+    INSERT INTO trade_stats_daily (trade_date, symbol, trade_condition, calls, puts, wins, losses, pending)
+        SELECT 
+            DATE(buy_timestamp), 
+            symbol, 
+            trade_condition, 
+            0, 
+            0, 
+            SUM(%s = 'W'), 
+            SUM(%s = 'L'), 
+            SUM(%s = 'P') - COUNT(*)
+        FROM trade 
+        WHERE 
+            trade_condition = %s AND 
+            trade_action = 'BUY' AND 
+            result = 'P' AND 
+            symbol = %s AND 
+            trade_right = %s
+        GROUP BY DATE(buy_timestamp), symbol, trade_condition
+    ON DUPLICATE KEY UPDATE 
+        wins = wins + VALUES(wins), 
+        losses = losses + VALUES(losses), 
+        pending = pending + VALUES(pending)
+"""
+
+# Counters of each buy date from %s up to today
+RETRIEVE_TRADE_STATS = """
+    SELECT trade_date, SUM(calls), SUM(puts), SUM(wins), SUM(losses), SUM(pending) 
+        FROM trade_stats_daily 
+        WHERE trade_date >= %s AND trade_date <= CURDATE() 
+        GROUP BY trade_date
+"""
+
 RETRIEVE_NET_LIQUIDITY = """
     SELECT * FROM account_summary
 """
 
-EXPORT_ALL_TRADES_CSV = """
+# Trades bought in a range for the CSV export, the range and filters are added
+# in place of {filters} so the buy_timestamp index gives the order
+EXPORT_TRADES_CSV = """
     SELECT 
-        'id',
-        'symbol',
-        'trade_condition',
-        'trade_action',
-        'trade_right',
-        'contracts',
-        'entryprice',
-        'strikeprice',
-        'stoploss',
-        'take_profit',
-        'buy_delta',
-        'buy_gamma',
-        'buy_ask',
-        'buy_implied_vol',
-        'sell_delta',
-        'sell_gamma',
-        'sell_ask',
-        'sell_implied_vol',
-        'result',
-        'buy_timestamp',
-        'sell_timestamp'
-    UNION ALL
-    SELECT * FROM trade
-"""
-
-EXPORT_DAILY_CSV = """
+        id, 
+        symbol, 
+        trade_condition, 
+        trade_action, 
+        trade_right, 
+        contracts, 
+        entryprice, 
+        strikeprice, 
+        stoploss, 
+        take_profit, 
+        buy_delta, 
+        buy_gamma, 
+        buy_theta, 
+        buy_ask, 
+        buy_bid, 
+        buy_implied_vol, 
+        sell_delta, 
+        sell_gamma, 
+        sell_theta, 
+        sell_ask, 
+        sell_bid, 
+        sell_implied_vol, 
+        result, 
+        buy_timestamp, 
+        sell_timestamp 
+    FROM trade 
+    WHERE TRUE{filters} 
+    ORDER BY buy_timestamp, id
+"""
+
+# Trades changed at or after %s for the analytics export, column order is
+# analytics_export.TRADE_COLUMNS
+EXPORT_CHANGED_TRADES = """
     SELECT 
-        'id',
-        'symbol',
-        'trade_condition',
-        'trade_action',
-        'trade_right',
-        'contracts',
-        'entryprice',
-        'strikeprice',
-        'stoploss',
-        'take_profit',
-        'buy_delta',
-        'buy_gamma',
-        'buy_ask',
-        'buy_implied_vol',
-        'sell_delta',
-        'sell_gamma',
-        'sell_ask',
-        'sell_implied_vol',
-        'result',
-        'buy_timestamp',
-        'sell_timestamp'
-    UNION ALL
-    SELECT * FROM trade WHERE buy_timestamp > DATE(NOW()) - INTERVAL 1 DAY
+        id, 
+        symbol, 
+        trade_condition, 
+        trade_action, 
+        trade_right, 
+        contracts, 
+        entryprice, 
+        strikeprice, 
+        stoploss, 
+        take_profit, 
+        buy_delta, 
+        buy_gamma, 
+        buy_theta, 
+        buy_ask, 
+        buy_bid, 
+        buy_implied_vol, 
+        sell_delta, 
+        sell_gamma, 
+        sell_theta, 
+        sell_ask, 
+        sell_bid, 
+        sell_implied_vol, 
+        result, 
+        buy_timestamp, 
+        sell_timestamp, 
+        updated_timestamp 
+    FROM trade 
+    WHERE updated_timestamp >= %s 
+    ORDER BY updated_timestamp, id
 """
 
 END_OF_DAY_RESULTS = """
@@ -0,0 +1,104 @@
+"""
+    Checks of signal admission and coalescing, the parts of the signal path
+    that only use the bot's memory.
+
+        python -m pytest test_admission.py
+"""
+import admission
+import constants
+import positions
+
+TRADED_CONDITIONS = {'AMZN': ['sma']}
+KEY = positions.position_key('AMZN', 'sma', constants.CALL)
+
+
+def signal(action, price=100.0, right=constants.CALL, condition='sma'):
+    return {
+        'symbol': 'AMZN',
+        'order': {
+            'condition': condition,
+            'price': price,
+            'stoploss': 0,
+            'takeProfit': 0,
+            'right': right,
+            'action': action,
+            'result': 'P'
+        }
+    }
+
+
+def new_admission(book=None):
+    return admission.SignalAdmission(TRADED_CONDITIONS, book if book is not None else positions.PositionBook(),
+                                     dedup_window=30, market_open=None, market_close=None, check_market_hours=False)
+
+
+def test_buy_sell_buy_at_the_same_price_is_admitted():
+    signal_admission = new_admission()
+
+    assert signal_admission.admit(signal(constants.BUY), now=0) is None
+    assert signal_admission.admit(signal(constants.SELL), now=1) is None
+    assert signal_admission.admit(signal(constants.BUY), now=2) is None
+
+
+def test_retried_alert_is_a_duplicate():
+    signal_admission = new_admission()
+
+    assert signal_admission.admit(signal(constants.BUY), now=0) is None
+    assert "duplicate" in signal_admission.admit(signal(constants.BUY), now=1)
+
+
+def test_repeat_after_the_window_is_judged_on_position():
+    signal_admission = new_admission()
+
+    assert signal_admission.admit(signal(constants.BUY), now=0) is None
+    assert "already has an open position" in signal_admission.admit(signal(constants.BUY), now=60)
+
+
+def test_sell_without_position_is_rejected():
+    assert "no open position" in new_admission().admit(signal(constants.SELL), now=0)
+
+
+def test_keys_are_admitted_independently():
+    signal_admission = new_admission()
+
+    assert signal_admission.admit(signal(constants.BUY), now=0) is None
+    assert signal_admission.admit(signal(constants.BUY, right=constants.PUT), now=0) is None
+
+
+def test_untraded_condition_is_rejected():
+    assert "no condition" in new_admission().admit(signal(constants.BUY, condition='rsi'), now=0)
+
+
+def test_settle_falls_back_to_the_position_book():
+    book = positions.PositionBook()
+    signal_admission = new_admission(book)
+
+    assert signal_admission.admit(signal(constants.BUY), now=0) is None
+    # The BUY found no contract, so the book never opened a position
+    signal_admission.settle(KEY)
+
+    assert signal_admission.admit(signal(constants.BUY, price=101.0), now=1) is None
+
+
+def test_burst_ending_in_buy_buys_when_flat():
+    burst = [signal(constants.BUY), signal(constants.SELL), signal(constants.BUY)]
+
+    assert admission.coalesce_signals(burst, position_open=False) is burst[-1]
+
+
+def test_burst_ending_in_buy_does_nothing_when_open():
+    burst = [signal(constants.SELL), signal(constants.BUY)]
+
+    assert admission.coalesce_signals(burst, position_open=True) is None
+
+
+def test_burst_that_nets_out_does_nothing_when_flat():
+    burst = [signal(constants.BUY), signal(constants.SELL)]
+
+    assert admission.coalesce_signals(burst, position_open=False) is None
+
+
+def test_burst_ending_in_sell_sells_when_open():
+    burst = [signal(constants.SELL), signal(constants.BUY), signal(constants.SELL)]
+
+    assert admission.coalesce_signals(burst, position_open=True) is burst[-1]
@@ -1,13 +1,16 @@
+import collections
+import datetime
 import redis
 import mysql.connector
 
 import config
-import constants
+import signals
 import tables
 import json
 import csv
 import io
-from flask import Flask, request, json, render_template, make_response
+import zlib
+from flask import Flask, Response, request, json, jsonify, render_template
 
 app = Flask(__name__)
 
@@ -15,39 +18,67 @@ app = Flask(__name__)
 r = redis.Redis(host='localhost', port=config.redis_port, db=0)
 
 
+def publish_signal(data):
+    signals.publish_signal(r, data)
+
+
+def get_trade_stats(cursor):
+    """
+        Counters of today, yesterday and the current month from the
+        trade_stats_daily rollup, one row per day however many trades there
+        were.
+    """
+    today = datetime.date.today()
+    yesterday = today - datetime.timedelta(days=1)
+    month_start = today.replace(day=1)
+
+    cursor.execute(tables.RETRIEVE_TRADE_STATS, (min(yesterday, month_start),))
+
+    stats = {
+        'today': collections.Counter(),
+        'yesterday': collections.Counter(),
+        'month': collections.Counter()
+    }
+
+    for trade_date, calls, puts, wins, losses, pending in cursor.fetchall():
+        day = collections.Counter({
+            'calls': int(calls), 'puts': int(puts), 'wins': int(wins), 'losses': int(losses),
+            'pending': int(pending)
+        })
+
+        if trade_date == today:
+            stats['today'].update(day)
+        elif trade_date == yesterday:
+            stats['yesterday'].update(day)
+
+        if trade_date >= month_start:
+            stats['month'].update(day)
+
+    return stats
+
+
 @app.route('/', methods=['GET'])
 def dashboard():
-    trades_today = []
-    trades_yesterday = []
-    trades_current_month = []
+    stats = {'today': collections.Counter(), 'yesterday': collections.Counter(), 'month': collections.Counter()}
 
     try:
         cnx = mysql.connector.connect(**config.database_config)
         cursor = cnx.cursor(buffered=True)
-        cursor.execute(tables.RETRIEVE_TRADE_DATA_TODAY)
-        trades_today = cursor.fetchall()
-        cursor.execute(tables.RETRIEVE_TRADE_DATA_YESTERDAY)
-        trades_yesterday = cursor.fetchall()
-        cursor.execute(tables.RETRIEVE_TRADE_CURRENT_MONTH)
-        trades_current_month = cursor.fetchall()
+        stats = get_trade_stats(cursor)
         cursor.close()
     except mysql.connector.Error as err:
         print("Failed retrieving from database: {}".format(err))
 
-    total_call_trades = sum((1 for i in trades_today if i[4] == constants.CALL))
-    total_put_trades = sum((1 for i in trades_today if i[4] == constants.PUT))
-    total_wins = sum((1 for i in trades_today if i[22] == 'W'))
-    total_losses = sum((1 for i in trades_today if i[22] == 'L'))
-    total_pending = sum((1 for i in trades_today if i[22] == 'P'))
-    yesterday_total_wins = sum((1 for i in trades_yesterday if i[22] == 'W'))
-    yesterday_total_losses = sum((1 for i in trades_yesterday if i[22] == 'L'))
-    yesterday_total_pending = sum((1 for i in trades_yesterday if i[22] == 'P'))
-    monthly_total_wins = sum((1 for i in trades_current_month if i[22] == 'W'))
-    monthly_total_losses = sum((1 for i in trades_current_month if i[22] == 'L'))
-
-    list(trades_today)
-    list(trades_yesterday)
-    list(trades_current_month)
+    total_call_trades = stats['today']['calls']
+    total_put_trades = stats['today']['puts']
+    total_wins = stats['today']['wins']
+    total_losses = stats['today']['losses']
+    total_pending = stats['today']['pending']
+    yesterday_total_wins = stats['yesterday']['wins']
+    yesterday_total_losses = stats['yesterday']['losses']
+    yesterday_total_pending = stats['yesterday']['pending']
+    monthly_total_wins = stats['month']['wins']
+    monthly_total_losses = stats['month']['losses']
 
     pie_chart_array = [total_wins, total_losses, total_pending]
     yesterday_pie_chart_array = [yesterday_total_wins, yesterday_total_losses, yesterday_total_pending]
@@ -55,7 +86,6 @@ def dashboard():
 
     return render_template(
         "dashboard.html",
-        signals=trades_today,
         total_call_trades=total_call_trades,
         total_put_trades=total_put_trades,
         pie_chart_array=json.dumps(pie_chart_array),
@@ -70,29 +100,214 @@ def dashboard():
     )
 
 
-@app.route('/generate')
-def generate():
-    signals = []
+TRADE_FILTERS = {
+    'symbol': " AND symbol = %s",
+    'condition': " AND trade_condition = %s",
+    'result': " AND result = %s"
+}
+
+
+def parse_trades_page_request(args):
+    """
+        Date range, filters, cursor and page size of a /api/trades request.
+        Raises ValueError for anything that can't be parsed.
+    """
+    day = datetime.date.fromisoformat(args.get('date', datetime.date.today().isoformat()))
+    limit = min(int(args.get('limit', config.TRADES_PAGE_SIZE)), config.TRADES_PAGE_MAX_SIZE)
+
+    if limit < 1:
+        raise ValueError("limit must be at least 1")
+
+    filters = ""
+    params = [day, day + datetime.timedelta(days=1)]
 
+    for name, condition in TRADE_FILTERS.items():
+        if args.get(name):
+            filters += condition
+            params.append(args[name])
+
+    after = args.get('after')
+    if after:
+        # Cursor is the buy_timestamp and id of the last trade of the previous page
+        after_timestamp, after_id = after.rsplit(',', 1)
+        after_timestamp = datetime.datetime.fromisoformat(after_timestamp)
+        filters += tables.TRADES_PAGE_AFTER
+        params.extend([after_timestamp, after_timestamp, int(after_id)])
+
+    # One extra trade tells whether there's another page
+    params.append(limit + 1)
+
+    return tables.RETRIEVE_TRADES_PAGE.format(filters=filters), params, limit
+
+
+@app.route('/api/trades', methods=['GET'])
+def trades_api():
+    """
+        Trades bought on ?date= (today by default) as JSON, a page at a time
+        in the order they were bought.  Optional ?symbol=, ?condition= and
+        ?result= filters.  Pass the response's "next" as ?after= for the
+        following page, it's null on the last one.
+    """
+    try:
+        query, params, limit = parse_trades_page_request(request.args)
+    except ValueError as err:
+        return jsonify({'error': str(err)}), 400
+
+    cnx = None
     try:
         cnx = mysql.connector.connect(**config.database_config)
         cursor = cnx.cursor()
-        cursor.execute(tables.EXPORT_DAILY_CSV)
-        signals = cursor.fetchall()
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
         cursor.close()
+    except mysql.connector.Error as err:
+        print("Failed retrieving trades from database: {}".format(err))
+        return jsonify({'error': "Failed retrieving trades"}), 500
+    finally:
+        if cnx is not None:
+            cnx.close()
+
+    trades = [{
+        'id': row[0],
+        'symbol': row[1],
+        'condition': row[2],
+        'right': row[3],
+        'contracts': row[4],
+        'result': row[5],
+        'buy_timestamp': row[6].isoformat(sep=' '),
+        'sell_timestamp': row[7].isoformat(sep=' ') if row[7] else None
+    } for row in rows[:limit]]
+
+    next_page = None
+    if len(rows) > limit:
+        next_page = "{},{}".format(trades[-1]['buy_timestamp'], trades[-1]['id'])
+
+    return jsonify({'trades': trades, 'next': next_page})
+
+
+EXPORT_FILTERS = {
+    'symbol': " AND symbol = %s",
+    'condition': " AND trade_condition = %s"
+}
+
+
+def parse_export_request(args, default_start=None):
+    """
+        Query and parameters of an export for ?start= and ?end= dates (end
+        included) and the optional ?symbol= and ?condition= filters.  Raises
+        ValueError for a date that can't be parsed.
+    """
+    filters = ""
+    params = []
+
+    start = args.get('start', default_start)
+    if start:
+        filters += " AND buy_timestamp >= %s"
+        params.append(datetime.date.fromisoformat(str(start)))
+
+    end = args.get('end')
+    if end:
+        filters += " AND buy_timestamp < %s"
+        params.append(datetime.date.fromisoformat(end) + datetime.timedelta(days=1))
+
+    for name, condition in EXPORT_FILTERS.items():
+        if args.get(name):
+            filters += condition
+            params.append(args[name])
+
+    return tables.EXPORT_TRADES_CSV.format(filters=filters), params
+
+
+def stream_csv(cnx, cursor, compress):
+    """
+        Yields the CSV a chunk of rows at a time, read from the unbuffered
+        cursor of an executed query so only one chunk is ever held in
+        memory.  Gzipped as it goes when compress is set.  Closes the
+        connection once it's done.
+    """
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def encode():
+        data = buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate(0)
+        return compressor.compress(data) if compressor else data
+
+    try:
+        writer.writerow(cursor.column_names)
+
+        while True:
+            rows = cursor.fetchmany(config.EXPORT_CHUNK_SIZE)
+            if not rows:
+                break
+
+            writer.writerows(rows)
+            yield encode()
+
+        cursor.close()
+    except mysql.connector.Error as err:
+        # The response has already started, so all that can be done is to end it early
+        print("Failed downloading CSV file: {}".format(err))
+    finally:
+        cnx.close()
+
+    data = encode()
+    if compressor:
+        data += compressor.flush()
+    if data:
+        yield data
+
+
+def export_response(default_start=None):
+    try:
+        query, params = parse_export_request(request.args, default_start)
+    except ValueError as err:
+        return jsonify({'error': str(err)}), 400
+
+    compress = request.args.get('gzip') in ('1', 'true')
+    filename = "export.csv.gz" if compress else "export.csv"
+
+    # Connected and queried before the response starts, so a database
+    # failure is a 500 rather than an empty download
+    cnx = None
+    try:
+        cnx = mysql.connector.connect(**config.database_config)
+        cursor = cnx.cursor()
+        cursor.execute(query, params)
     except mysql.connector.Error as err:
         print("Failed downloading CSV file: {}".format(err))
+        if cnx is not None:
+            cnx.close()
+        return jsonify({'error': "Failed exporting trades"}), 500
 
-    si = io.StringIO()
-    cw = csv.writer(si)
-    cw.writerows(signals)
-    output = make_response(si.getvalue())
-    output.headers["Content-Disposition"] = "attachment; filename=export.csv"
-    output.headers["Content-type"] = "text/csv"
+    output = Response(stream_csv(cnx, cursor, compress),
+                      mimetype="application/gzip" if compress else "text/csv")
+    output.headers["Content-Disposition"] = "attachment; filename={}".format(filename)
+    # A client gone before the first chunk never runs the generator's cleanup
+    output.call_on_close(cnx.close)
 
     return output
 
 
+@app.route('/generate')
+def generate():
+    """
+        Trades since the start of yesterday, the dashboard's report.
+    """
+    return export_response(default_start=datetime.date.today() - datetime.timedelta(days=1))
+
+
+@app.route('/export')
+def export():
+    """
+        Streams trades as CSV, all of them unless limited with ?start=,
+        ?end=, ?symbol= or ?condition=.  ?gzip=1 downloads it gzipped.
+    """
+    return export_response()
+
+
 @app.route('/tradingview', methods=['POST'])
 def alert():
     """
@@ -100,12 +315,19 @@ def alert():
 
         Any alert is then published to redis server, which the message then
         gets picked up by iboptions.py to buy or sell to Interactive Brokers.
+        In stream mode the alert is kept until the bot acknowledges it, so
+        nothing is lost while the bot is restarting.
     """
     data = request.data
 
     if data:
-        trade_message = json.loads(request.data)
-        r.publish('tradingview', data)
+        try:
+            trade_message = signals.validate_alert(data)
+        except ValueError as err:
+            print("Rejected alert: {}".format(err))
+            return jsonify({'error': str(err)}), 400
+
+        publish_signal(data)
 
         symbol = trade_message['symbol']
         condition = trade_message['order']['condition']